@@ -1,27 +1,52 @@
-import os
-from uuid import uuid4
-from streamlit_local_storage import LocalStorage
-from openai import OpenAI
-from google.genai import types
 import json
+from uuid import uuid4
 import streamlit as st
-import re
-from google import genai
-from dotenv import load_dotenv
-
-load_dotenv()
+from streamlit.errors import StreamlitAPIException
+from ophub import config
+from ophub.analysis import Analyzer
+from ophub.history import HistoryStore, LocalStorageBackend, SqliteHistoryBackend, new_entry
+from ophub.jobs import QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from ophub.metrics import metrics
+from ophub.search import OPEN, COMPLETED
+from ophub.similar import OFFER
+from ophub.retry import totals
 
 # Streamlit page config
 st.set_page_config(layout="wide")
 
-# Secrets from Streamlit or locally
+# Secrets from Streamlit or locally (.env is loaded on first use)
 def get_secret(key):
     try:
         if key in st.secrets: #Streamlit secrets
             return st.secrets[key]
     except (FileNotFoundError, Exception):
         pass 
-    return os.getenv(key) #local env fetch
+    return config.env_secret(key) #local env fetch
+
+# Analysis core shared by every session: client pools, caches, guide index, latency samples.
+# The SDK of a provider is only imported once that provider is used.
+@st.cache_resource
+def get_analyzer():
+    return Analyzer(get_secret)
+
+# Token prices, JSON metrics log and the /metrics endpoint (once per process)
+@st.cache_resource
+def setup_metrics():
+    return config.configure_metrics(get_secret)
+
+setup_metrics()
+
+# Background analyses shared by every session (capped per provider)
+@st.cache_resource
+def get_job_queue():
+    return config.load_job_queue(get_secret, get_analyzer().targets())
+
+# Rerun just the calling fragment (falls back to a full rerun outside a fragment rerun)
+def rerun_fragment():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
 # Session state cleanup for notes
 if st.session_state.get("pending_clear_notes"):
@@ -36,248 +61,197 @@ def open_archive():
 # Initialize session state variables
 if "archive_open" not in st.session_state:
     st.session_state.archive_open = False
-if "trash_archive" not in st.session_state:
-    st.session_state.trash_archive = []
+if "session_owner" not in st.session_state:
+    st.session_state.session_owner = uuid4().hex # tags this session's background jobs
 if "run_ai_now" not in st.session_state:
     st.session_state.run_ai_now = False
 if "user_input_key" not in st.session_state:
     st.session_state.user_input_key = "I need an open job, I only have a SAN and CA" # DEBUG TEXT --- REMOVE IN PRODUCTION
 
-# User history
-ls=LocalStorage()
-STORAGE_KEY="user_history_v1"
-# Load 
-def get_history():
-    if "local_history_cache" in st.session_state:
-        return st.session_state.local_history_cache
-    stored_data=ls.getItem(STORAGE_KEY)
-    if stored_data is not None:
-        st.session_state.local_history_cache=stored_data
-        return stored_data
-    return []
-def save_whole_history(history_data):
-    st.session_state.local_history_cache = history_data
-    ls.setItem(STORAGE_KEY, history_data)
-
-# Format the AI response and convert the JSON list into checkboxes
-def parse_tasks(text):
-    # Search for a pattern starting with [ and ending with ]
-    match = re.search(r'\[.*\]', text, re.DOTALL)
-    
-    if match:
-        # Extract only the bracketed part
-        clean_json = match.group(0)
-        task_names = json.loads(clean_json)
-        # Create the list of task dictionaries
-        return [{"task": name, "done": False} for name in task_names]
-    
-    # If no brackets are found, trigger the fallback
-    raise ValueError("No JSON list found")
+# User history (the browser storage component is only loaded for the local backend)
+if config.history_backend(get_secret) != "sqlite":
+    from streamlit_local_storage import LocalStorage
+    ls=LocalStorage()
+
+# Server-side history file shared by the whole process (HISTORY_BACKEND=sqlite)
+@st.cache_resource
+def get_sqlite_history_store():
+    return HistoryStore(SqliteHistoryBackend(config.history_db_path(get_secret),
+                                             trash_days=config.history_trash_days(get_secret)))
+
+# Task toggles are buffered and sent to the browser in one go (HISTORY_WRITE_DELAY); the sqlite
+# store is shared by every session and its writes are cheap, so it stays write-through.
+def history_write_delay():
+    if config.history_backend(get_secret) == "sqlite":
+        return 0
+    return config.history_write_delay(get_secret)
+
+# Load (indexed store: browser LocalStorage per session by default)
+def get_history_store():
+    if config.history_backend(get_secret) == "sqlite":
+        return get_sqlite_history_store()
+    # The component answers on a later run; until then getAll() is its empty default, which is
+    # not cached (the v1/v2 keys would never be migrated), so the store is built again once data came
+    if "history_store" not in st.session_state:
+        store = HistoryStore(LocalStorageBackend(ls), write_delay=history_write_delay())
+        if not ls.getAll():
+            return store
+        st.session_state.history_store = store
+    store = st.session_state.history_store
+    store.backend.ls = ls  # this run's component (deleteItem only knows the keys it read)
+    return store
 
 def save_to_history(project_name, reasoning, tasks):
-    history = get_history()
     # Create new entry
-    new_entry = {
-        "id": uuid4().hex,
-        "project": project_name,
-        "reasoning": reasoning,
-        "tasks": tasks
-    }
-    history.insert(0, new_entry)
-    save_whole_history(history)
+    return get_history_store().add(new_entry(project_name, reasoning, tasks))
 
 def update_task_status(project_id, task_index, new_status):
-    current_history=get_history()
-    for item in current_history:
-        if item["id"] == project_id:
-            item["tasks"][task_index]["done"] = new_status
-            break
-    save_whole_history(current_history)
+    get_history_store().update_task(project_id, task_index, new_status)
 
 def delete_from_history(project_id):
-    current_history = get_history()
-    deleted_item = None
-    new_history = []
-    
-    for item in current_history:
-        if item["id"] == project_id and deleted_item is None:
-            deleted_item = item
-        else:
-            new_history.append(item)
-            
-    if deleted_item:
-        save_whole_history(new_history)
-            
-    return deleted_item
+    return get_history_store().delete(project_id)
 
 # name uniqueness checker
-def get_unique_name(existing_history, target_name):
+def get_unique_name(target_name):
     # Checks if a name exists and adds (1), (2), etc. if needed.
-    existing_names = [item["project"] for item in existing_history]
-    if target_name not in existing_names:
-        return target_name
-    
-    counter = 1
-    new_name = f"{target_name} ({counter})"
-    while new_name in existing_names:
-        counter += 1
-        new_name = f"{target_name} ({counter})"
-    return new_name
+    return get_history_store().unique_name(target_name)
 
 # Rename function to the history sidebar
 def rename_project_in_history(project_id, new_name):
-    current_history = get_history()
-    final_name = get_unique_name(current_history, new_name)
-    
-    for item in current_history:
-        if item["id"] == project_id:
-            item["project"] = final_name
-            break
-            
-    save_whole_history(current_history)
-    return final_name
+    return get_history_store().rename(project_id, new_name)
 
 # --- HYBRID AI ENGINE ---
-def analysis_engine(kb, notes):
-    st.info("Analysis started")
-    
-    # 1. Check if we are using Gemini (Cloud) or Ollama (Local)
-    target_model = get_secret("AI_MODEL_NAME") or "gpt-oss:20b"
-    is_google_native = "gemini" in target_model.lower()
-    
-    # Convert old Gemini model names to new format
-    if is_google_native:
-        # Remove "models/" prefix if present
-        target_model = target_model.replace("models/", "")
-        # Map old model names to new equivalents
-        model_mapping = {
-            "gemini-1.5-flash-latest": "gemini-2.5-flash",
-            "gemini-1.5-flash": "gemini-2.5-flash",
-            "gemini-1.5-pro-latest": "gemini-2.5-pro",
-            "gemini-1.5-pro": "gemini-2.5-pro",
-            "gemini-pro": "gemini-2.5-pro",
-            "gemini-flash": "gemini-2.5-flash"
-        }
-        # Use mapping if available, otherwise keep as is but ensure it's a valid new format
-        target_model = model_mapping.get(target_model, target_model)
-
-    with st.spinner("Please wait a few seconds..."):
-        # Setup inputs
-        user_message = f"Guide:\n{kb}\n\nNotes:\n{notes}"
-
-        # System prompt (Identical for both)
-        system_instruction = (
-            "You are a Senior Operational Excellence Consultant. "
-            "STRICT REQUIREMENT: You must provide your output as a SINGLE VALID JSON OBJECT. "
-            "The JSON must have exactly two keys: "
-            "1. 'reasoning': A string explaining your thought process. "
-            "2. 'tasks': A list of strings for the actionable steps. "
-            "Do not include markdown formatting (like ```json). Just the raw JSON object."
+# Queue one analysis; ophub.analysis does the work on a background thread
+def submit_analysis(project_name, notes):
+    analyzer = get_analyzer()
+    targets = analyzer.targets()
+    use_cache = not st.session_state.get("bypass_cache") # "Force fresh analysis" box
+
+    def work(job):
+        return analyzer.analyze(
+            notes,
+            targets=targets,
+            use_cache=use_cache,
+            on_event=job.on_event,
+            cancel_event=job.cancel_event,
+            hold=job.hold, # failover / hedging backups wait for their own slot
         )
 
-        attempt = 0 
-        valid_response = False
-        max_attempts = 3
-
-        while attempt < max_attempts and not valid_response:
-            attempt += 1
-            try:
-                full_response = ""
-
-                # --- PATH A: GEMINI NATIVE (Fixes Cloud 404) ---
-                if is_google_native:
-                    genai_client = genai.Client(api_key=get_secret("AI_API_KEY"))
-                    response = genai_client.models.generate_content(
-                        model=target_model,
-                        contents=user_message,
-                        config=types.GenerateContentConfig(
-                            system_instruction=system_instruction,
-                            temperature=0.2
-                        )
-                    )
-                    full_response = response.text
-
-                # --- PATH B: OLLAMA / OPENAI (Your original code) ---
-                else:
-                    # API Client Setup
-                    client=OpenAI(
-                        base_url=get_secret("AI_BASE_URL"),
-                        api_key=get_secret("AI_API_KEY")
-                    )
-                    response = client.chat.completions.create(
-                        model=target_model,
-                        messages=[
-                            {"role": "system", "content": system_instruction},
-                            {"role": "user", "content": user_message}
-                        ],
-                        temperature=0.7,
-                        timeout=120
-                    )
-                    full_response = response.choices[0].message.content
-
-                # --- COMMON PARSING (Kept exactly as is) ---
-                if full_response:
-                    try:
-                        clean_text = full_response.replace("```json", "").replace("```", "").strip() # cleaning AI response
-                        data = json.loads(clean_text) # parsing
-                        reasoning = data.get("reasoning", "No reasoning provided.")
-                        task_names = data.get("tasks", [])
-                        tasks = [{"task": name, "done": False} for name in task_names]
-                        save_to_history(st.session_state.current_project_name, reasoning, tasks)
-
-                        st.session_state.selected_analysis = {
-                            "project": st.session_state.current_project_name,
-                            "reasoning": reasoning,
-                            "tasks": tasks
-                        }
-                        valid_response = True
-                        
-                    except json.JSONDecodeError:
-                        st.warning(f"Attempt {attempt}: AI did not return valid JSON. Retrying...")
-                        continue
-                    except Exception as e:
-                        st.warning(f"Attempt {attempt}: Parsing error: {e}")
-                        continue
-                else:
-                    st.warning(f"Attempt {attempt}: Empty response. Retrying...")
-                
-            except Exception as e:
-                st.error(f"Error ({'Gemini' if is_google_native else 'Ollama'}): {e}")
-                continue
-
-        # Final Cleanup
-        if valid_response:
-            st.session_state.run_ai_now = False 
-            if "current_project_name" in st.session_state:
-                del st.session_state.current_project_name
-            st.session_state.pending_clear_notes = True
+    # the job is queued on the primary backend's concurrency cap
+    return get_job_queue().submit(st.session_state.session_owner, project_name, targets[0].name, work)
+
+# Move finished jobs into the history
+def collect_finished_jobs(job_queue):
+    new_entries = []
+    for job in job_queue.jobs(st.session_state.session_owner):
+        if job.status != DONE:
+            continue
+        tasks = [{"task": name, "done": False} for name in job.result["tasks"]]
+        with metrics.time("save"):
+            new_entries.append(save_to_history(get_unique_name(job.project), job.result["reasoning"], tasks))
+        job_queue.forget(job.id)
+    return new_entries
+
+JOB_LABELS = {
+    QUEUED: "⏳ Queued",
+    RUNNING: "🔄 Running",
+    FAILED: "🚨 Failed",
+    CANCELLED: "⛔ Cancelled",
+}
+
+# Job status panel (polls once a second without rerunning the whole page)
+@st.fragment(run_every=1)
+def jobs_panel():
+    job_queue = get_job_queue()
+    job_queue.prune()
+
+    new_entries = collect_finished_jobs(job_queue)
+    if new_entries:
+        if "selected_analysis" not in st.session_state:
+            st.session_state.selected_analysis = new_entries[-1]
             st.query_params["view"] = "results"
-            st.rerun()
-        else:
-            st.session_state.run_ai_now = False
-            st.error("🚨 Please refresh the page and try again.")
-
-# load history file
-all_history = get_history()
+        st.rerun() # full rerun so the sidebar shows the new projects
+
+    my_jobs = job_queue.jobs(st.session_state.session_owner)
+    if not my_jobs:
+        return
+    st.subheader("Analyses in progress ⏳")
+    for job in my_jobs:
+        with st.container(border=True):
+            col_name, col_action = st.columns([0.85, 0.15])
+            with col_name:
+                st.markdown(f"**{job.project}** — {JOB_LABELS.get(job.status, job.status)}")
+            with col_action:
+                if job.is_finished:
+                    if st.button("Dismiss", key=f"job_dismiss_{job.id}", use_container_width=True):
+                        job_queue.forget(job.id)
+                        rerun_fragment()
+                elif st.button("Cancel", key=f"job_cancel_{job.id}", use_container_width=True):
+                    job_queue.cancel(job.id)
+                    rerun_fragment()
+
+            if job.status == RUNNING and (job.reasoning or job.tasks):
+                with st.expander("Live preview", expanded=False):
+                    st.write(job.reasoning)
+                    st.markdown("\n".join(f"- {name}" for name in job.tasks))
+            for message in job.messages[-3:]:
+                st.caption(message)
+            if job.status == FAILED:
+                st.error(f"🚨 {job.error}. Please try again.")
+
+# load history file (indexed store, built once per session)
+# Every full rerun picks up what other sessions/processes saved (sqlite) and
+# writes buffered task toggles (opening another project, closing the view, ...)
+get_history_store().sync()
+get_history_store().flush()
 
 # UI at the top
 st.title("🚀 AI Operational Hub")
 st.write("Welcome to your program management dashboard.")
 
 # ---ANALYZER BUTTON LOGIC ---
-# Setup variables needed for the AI call
-knowledge_base = ""
-if st.session_state.get("user_input_key"):
-    try:
-        with open("guide.txt", "r") as f:
-            knowledge_base = f.read()
-    except FileNotFoundError:
-        pass
-
 if st.session_state.get("run_ai_now"):
     captured_notes = st.session_state.get("user_input_key", "")
-    analysis_engine(knowledge_base, captured_notes)
-    st.stop()
+    # AI_SIMILAR_MODE=offer: near-identical notes were analyzed before, let the user pick
+    match = None
+    if config.similar_mode(get_secret) == OFFER and not st.session_state.get("bypass_cache"):
+        match = get_analyzer().find_similar(captured_notes)
+    if match:
+        st.session_state.similar_offer = {"project": st.session_state.current_project_name,
+                                          "notes": captured_notes, "match": match}
+    else:
+        submit_analysis(st.session_state.current_project_name, captured_notes)
+    st.session_state.run_ai_now = False
+    del st.session_state.current_project_name
+    st.session_state.pending_clear_notes = True
+    st.rerun()
+
+if "similar_offer" in st.session_state:
+    offer = st.session_state.similar_offer
+    with st.container(border=True):
+        st.markdown(f"**{offer['project']}**: these notes are {offer['match'].score:.0%} similar "
+                    "to notes analyzed before.")
+        with st.expander("Earlier notes", expanded=False):
+            st.write(offer["match"].notes)
+        col_reuse, col_fresh = st.columns(2)
+        with col_reuse:
+            if st.button("Use previous analysis ♻️", key="similar_reuse", use_container_width=True):
+                result = offer["match"].result
+                tasks = [{"task": name, "done": False} for name in result["tasks"]]
+                with metrics.time("save"):
+                    st.session_state.selected_analysis = save_to_history(
+                        get_unique_name(offer["project"]), result["reasoning"], tasks)
+                st.query_params["view"] = "results"
+                del st.session_state.similar_offer
+                st.rerun()
+        with col_fresh:
+            if st.button("Analyze anyway 🚀", key="similar_fresh", use_container_width=True):
+                submit_analysis(offer["project"], offer["notes"])
+                del st.session_state.similar_offer
+                st.rerun()
+
+if get_job_queue().jobs(st.session_state.session_owner):
+    jobs_panel()
 
 # Siderbar - Project List and New Project Creation
 with st.sidebar:
@@ -322,7 +296,7 @@ with st.sidebar:
                                 st.error("No notes found to analyze!")
                             else:
                                 # success logic
-                                final_name = get_unique_name(all_history, new_proj_name)
+                                final_name = get_unique_name(new_proj_name)
                                 st.session_state.current_project_name = final_name
                                 # note clearing
                                 if "selected_analysis" in st.session_state:
@@ -332,6 +306,51 @@ with st.sidebar:
                                 st.session_state.run_ai_now = True
                                 st.rerun()
 
+# Checkbox callback: the entry changes right away, the history write is buffered
+def toggle_task(entry, task_index, key):
+    close_archive() # Close archive
+    entry["tasks"][task_index]["done"] = st.session_state[key]
+    if entry.get("id") in get_history_store():
+        update_task_status(entry["id"], task_index, st.session_state[key])
+
+# Writes the buffered toggles once clicks stop. It is only started while something is buffered,
+# and the tick after the write does a full rerun, which doesn't start it again.
+# Toggles still buffered when the tab is closed are lost (at most HISTORY_WRITE_DELAY seconds
+# of clicks); HISTORY_WRITE_DELAY=0 writes every click instead.
+@st.fragment(run_every=history_write_delay() or None)
+def toggle_flush_timer():
+    store = get_history_store()
+    if not store.pending():
+        st.rerun() # written on the previous tick: stop polling
+    store.flush(due_only=True)
+
+# Ticking tasks reruns only this column
+@st.fragment
+def requirements_panel(selected):
+    st.subheader("Requirements 📋")
+    # 1. Get the tasks list from our selected analysis
+    tasks_list = selected.get('tasks', [])
+
+    # 2. tasks in checkboxes (i for unique key)
+    for i, task_info in enumerate(tasks_list):
+        display_name = task_info['task']
+        if task_info['done']:
+            # Apply green color, checkmark ------- to be reviewed
+            display_name = f":green[{display_name}]"
+
+        # new checkbox -------- to be reviewed
+        check_key = f"check_{selected['project']}_{i}"
+        st.checkbox(
+            display_name,
+            value=task_info['done'],
+            key=check_key,
+            on_change=toggle_task, # 3. status update in history (buffered)
+            args=(selected, i, check_key),
+        )
+
+    if get_history_store().pending():
+        toggle_flush_timer()
+
 # Display history entries
 if "selected_analysis" in st.session_state:
     selected = st.session_state.selected_analysis
@@ -344,29 +363,7 @@ if "selected_analysis" in st.session_state:
         st.subheader("Reasoning 🧠")
         st.write(selected['reasoning'])
     with col2:
-            st.subheader("Requirements 📋")
-            # 1. Get the tasks list from our selected analysis
-            tasks_list = selected.get('tasks', [])
-
-            # 2. tasks in checkboxes (i for unique key)
-            for i, task_info in enumerate(tasks_list):
-                display_name = task_info['task']
-                if task_info['done']:
-                    # Apply green color, checkmark ------- to be reviewed
-                    display_name = f":green[{display_name}]"
-
-                # new checkbox -------- to be reviewed
-                is_checked = st.checkbox(
-                    display_name, 
-                    value=task_info['done'], 
-                    key=f"check_{selected['project']}_{i}",
-                    on_change=close_archive # Close archive
-                )
-                # 3. status auto update in history file
-                if is_checked != task_info['done']:
-                    # update_task_status( selected['project'], i, is_checked)
-                    task_info['done'] = is_checked
-                    st.rerun()
+        requirements_panel(selected)
                    
     st.markdown("---") # Divider -------------- to be reviewed vs st.divider()
 
@@ -387,6 +384,7 @@ with st.form("analysis_form"):
         key="user_input_key",
         label_visibility="collapsed"
     )
+    st.checkbox("Force fresh analysis (skip cache)", key="bypass_cache")
     submitted = st.form_submit_button("Analyze Workflow 🚀", use_container_width=True)
     if submitted:
         if not user_input or not user_input.strip():
@@ -400,17 +398,12 @@ with st.form("analysis_form"):
                 st.rerun()
 
 # Sidebar Perm history display
-st.sidebar.divider()
-st.sidebar.subheader("Permanent History 📂")
-
-for idx, item in enumerate(list(all_history)):
-    # Rows 
-    col_btn, col_menu = st.sidebar.columns([0.85, 0.15])
-    rename_key = f"renaming_{idx}"
-    options_key = f"show_opts_{idx}" 
-    
-    active_id=st.session_state.get("selected_analysis", {}).get("id")
-    is_active=(active_id==item["id"])
+# One row of the list; everything is keyed by project id so rows keep their state across pages
+def history_row(item, is_active):
+    item_id = item["id"]
+    col_btn, col_menu = st.columns([0.85, 0.15])
+    rename_key = f"renaming_{item_id}"
+    options_key = f"show_opts_{item_id}"
 
     btn_type = "primary" if is_active else "secondary"
     
@@ -418,65 +411,147 @@ for idx, item in enumerate(list(all_history)):
     new_name = str(item['project'])
 
     if st.session_state.get(rename_key, False):
-        new_name = st.sidebar.text_input(
+        new_name = st.text_input(
             "New Name",
             value=item['project'],
-            key=f"input_{item['id']}_{idx}", 
+            key=f"input_{item_id}", 
             label_visibility="collapsed",
         )
     else:
         with col_btn:
-            if st.button(f"📁 {item['project']}", key=f"btn_{idx}", use_container_width=True, type=btn_type):
+            if st.button(f"📁 {item['project']}", key=f"btn_{item_id}", use_container_width=True, type=btn_type):
                 st.session_state.selected_analysis = item 
                 st.session_state.archive_open = False 
-                st.rerun()
+                st.rerun() # main area changes -> whole app
 
     # Rname Save/Cancel buttons
     if st.session_state.get(rename_key, False):
-        save_col, cancel_col = st.sidebar.columns(2) 
+        save_col, cancel_col = st.columns(2) 
         with save_col:
             # Input validation !
             is_valid_input = isinstance(new_name, str) and new_name.strip() != ""
             
-            if st.button("Save ✅", key=f"save_{idx}", use_container_width=True) or (new_name != item['project'] and is_valid_input):
+            if st.button("Save ✅", key=f"save_{item_id}", use_container_width=True) or (new_name != item['project'] and is_valid_input):
                 if new_name != item['project'] and is_valid_input:
-                    rename_project_in_history(item['id'], new_name)
+                    rename_project_in_history(item_id, new_name)
                 st.session_state[rename_key] = False
-                st.rerun()
+                st.rerun() if is_active else rerun_fragment()
         with cancel_col:
-            if st.button("Cancel ❌", key=f"can_{idx}", use_container_width=True):
+            if st.button("Cancel ❌", key=f"can_{item_id}", use_container_width=True):
                 st.session_state[rename_key] = False
-                st.rerun()
+                rerun_fragment()
                 
     with col_menu:
-        if st.button("⋮", key=f"toggle_{idx}", use_container_width=True):
+        if st.button("⋮", key=f"toggle_{item_id}", use_container_width=True):
             st.session_state[options_key] = not st.session_state.get(options_key, False)
-            st.rerun()
+            rerun_fragment()
 
     # Options: Rename / Delete
     if st.session_state.get(options_key, False):
-        opt_col1, opt_col2 = st.sidebar.columns(2)
+        opt_col1, opt_col2 = st.columns(2)
         with opt_col1:
-            if st.button("Rename ✏️", key=f"ren_opt_{idx}", use_container_width=True):
+            if st.button("Rename ✏️", key=f"ren_opt_{item_id}", use_container_width=True):
                 st.session_state[rename_key] = True
                 st.session_state[options_key] = False 
-                st.rerun()
+                rerun_fragment()
         with opt_col2:
-            if st.button("Delete 🗑️", key=f"del_opt_{idx}", use_container_width=True):
+            if st.button("Delete 🗑️", key=f"del_opt_{item_id}", use_container_width=True):
                 close_archive()
-                deleted = delete_from_history(item['id'])
-                if deleted:
-                    deleted['original_index'] = idx 
-                    st.session_state.trash_archive.append(deleted)
+                delete_from_history(item_id) # goes to the store's trash
                 
-                if st.session_state.get("selected_analysis", {}).get("project") == item['project']:
+                if is_active:
                     del st.session_state.selected_analysis
                 
                 st.session_state[options_key] = False 
-                st.rerun()
+                st.rerun() # trash list lives outside the fragment
+
+HISTORY_FILTERS = {"All": None, "Open tasks": OPEN, "Completed": COMPLETED}
+
+# Only the visible page builds widgets; clicks in here rerun just this fragment
+@st.fragment
+def history_sidebar():
+    store = get_history_store()
+    page_size = config.history_page_size(get_secret)
+
+    # Search names, reasoning and tasks (indexed by the store, so typing doesn't rescan the list)
+    query = st.text_input("Search", key="history_query", placeholder="🔍 Search projects, reasoning, tasks",
+                          label_visibility="collapsed")
+    status = HISTORY_FILTERS[st.radio("Filter", list(HISTORY_FILTERS), key="history_filter", horizontal=True,
+                                      label_visibility="collapsed")]
+    matches = store.search(query, status) if query.strip() or status else None
+
+    if matches is None:
+        page_count = store.page_count(page_size)
+    else:
+        page_count = max(1, -(-len(matches) // page_size))
+    page = min(st.session_state.get("history_page", 0), page_count - 1)
+
+    active_id = st.session_state.get("selected_analysis", {}).get("id") # looked up once, not per row
+    if matches is None:
+        items = store.page(page, page_size)
+    else:
+        items = matches[page * page_size:(page + 1) * page_size]
+        if not matches:
+            st.caption("No matching projects")
+    for item in items:
+        history_row(item, active_id == item["id"])
+
+    if page_count > 1:
+        prev_col, page_col, next_col = st.columns([0.3, 0.4, 0.3])
+        with prev_col:
+            if st.button("◀", key="history_prev", use_container_width=True, disabled=page == 0):
+                st.session_state.history_page = page - 1
+                rerun_fragment()
+        with page_col:
+            st.caption(f"Page {page + 1} of {page_count}")
+        with next_col:
+            if st.button("▶", key="history_next", use_container_width=True, disabled=page >= page_count - 1):
+                st.session_state.history_page = page + 1
+                rerun_fragment()
 
-# Deleted history
-if st.session_state.get("trash_archive"):
+st.sidebar.divider()
+st.sidebar.subheader("Permanent History 📂")
+with st.sidebar:
+    history_sidebar()
+
+# Import / export (history_log.json format)
+with st.sidebar.expander("Import / Export 📦"):
+    history_store = get_history_store()
+    st.download_button(
+        "Download history ⬇️",
+        data=lambda: json.dumps(history_store.export_entries(), indent=4, ensure_ascii=False), # built on click only
+        file_name="history_log.json",
+        mime="application/json",
+        use_container_width=True,
+    )
+    uploaded_history = st.file_uploader("Import history file", type="json", key="history_import")
+    if uploaded_history is not None and st.button("Import ⬆️", use_container_width=True):
+        added = history_store.import_entries(json.load(uploaded_history))
+        st.toast(f"Imported {len(added)} project(s)")
+        st.rerun()
+
+# Where the time goes (AI_DIAGNOSTICS=1); the same numbers are on /metrics with AI_METRICS_PORT
+@st.fragment
+def diagnostics_panel():
+    if st.button("Refresh 🔄", key="diagnostics_refresh", use_container_width=True):
+        rerun_fragment()
+    snapshot = metrics.snapshot()
+    st.caption("Stage timings (seconds, recent samples)")
+    st.dataframe(snapshot["stages"], hide_index=True)
+    st.caption("Attempts, tokens and cost")
+    st.dataframe(snapshot["counters"], hide_index=True)
+    st.caption("Retries")
+    st.json(totals.snapshot(), expanded=False)
+    st.caption("Clients, caches and guide index")
+    st.json(get_analyzer().stats(), expanded=False)
+
+if config.is_enabled(get_secret, "AI_DIAGNOSTICS", default="0"):
+    with st.sidebar.expander("Diagnostics 🩺"):
+        diagnostics_panel()
+
+# Deleted history (kept in the sqlite file with HISTORY_BACKEND=sqlite, so it survives a refresh
+# and is shared; per session otherwise). The list itself is only read while it is open.
+if get_history_store().has_trash():
     st.sidebar.markdown("---")
     
     # Hide/Show btn logic
@@ -489,28 +564,17 @@ if st.session_state.get("trash_archive"):
 
     if st.session_state.archive_open:
         with st.sidebar.container(border=True):
-            for arch_idx, arch_item in enumerate(reversed(st.session_state.trash_archive)):
+            for arch_item in reversed(get_history_store().trash()):
                 col_arch_name, col_restore = st.columns([0.90, 0.10])
                 
                 with col_arch_name:
                     st.markdown(f"**{arch_item['project']}**")
                 
                 with col_restore:
-                    if st.button("↩️", key=f"restore_{arch_idx}", help="Restore"):
-                        history = get_history()
-                        # Get original spot or default to top
-                        pos = arch_item.get('original_index', 0)
-                        
-                        # Safety: ensure position isn't larger than the list
-                        if pos > len(history):
-                            pos = len(history)
-                            
-                        history.insert(pos, arch_item)
-                        save_whole_history(history)
-                        
-                        # Calculate real index to remove from trash
-                        real_idx = len(st.session_state.trash_archive) - 1 - arch_idx
-                        st.session_state.trash_archive.pop(real_idx)
+                    if st.button("↩️", key=f"restore_{arch_item['id']}", help="Restore"):
+                        # Back to its original spot (clamped to the list size); leaves the trash too.
+                        # The entry itself is only read from the trash now.
+                        get_history_store().restore(arch_item)
                         
                         # Stay open after restore
                         open_archive() 
@@ -518,7 +582,7 @@ if st.session_state.get("trash_archive"):
 
             st.markdown("---")
             if st.button("Clear All 🗑️", use_container_width=True):
-                st.session_state.trash_archive = []
+                get_history_store().clear_trash()
                 st.session_state.archive_open = False
                 st.rerun()
 
@@ -0,0 +1 @@
+# Benchmarks for the history store and the analysis path (python -m bench.run)
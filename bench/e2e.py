@@ -0,0 +1,129 @@
+# End-to-end analysis benchmark: N sessions each submitting analyses one after the other
+# through the same Analyzer + JobQueue the app uses, against the local mock LLM server.
+import json
+import threading
+import time
+
+from ophub.analysis import Analyzer
+from ophub.config import load_job_queue
+from ophub.engine import AnalysisFailed
+from ophub.stub_server import StubConfig, start_background
+
+from bench.stats import summarize
+
+DEFAULT_SCENARIOS = [
+    {"name": "openai-stream", "provider": "openai", "streaming": True},
+    {"name": "openai-blocking", "provider": "openai", "streaming": False},
+    {"name": "gemini-stream", "provider": "gemini", "streaming": True},
+]
+
+
+def _settings(port, scenario, sessions):
+    if scenario["provider"] == "gemini":
+        provider = {"name": "stub", "model": "gemini-2.5-flash", "base_url": f"http://127.0.0.1:{port}/"}
+    else:
+        provider = {"name": "stub", "model": "stub-model", "base_url": f"http://127.0.0.1:{port}/v1"}
+    provider["api_key"] = "bench"
+    return {
+        "AI_PROVIDERS": json.dumps([provider]),
+        "AI_STREAMING": "1" if scenario["streaming"] else "0",
+        "AI_CACHE_ENABLED": "0",  # every request should reach the model
+        "AI_CONTEXT_CACHE": "0",
+        "AI_RETRY_BASE_DELAY": "0.05",
+        "AI_RETRY_MAX_DELAY": "0.2",
+        "AI_MAX_CONCURRENCY": str(scenario.get("max_concurrency", sessions)),
+        "AI_MAX_WORKERS": str(max(sessions, 1)),
+        "AI_GUIDE_PATH": scenario.get("guide", "guide.txt"),
+        "AI_KB_INDEX_PATH": "",  # don't write an index file while benchmarking
+    }
+
+
+def run_scenario(scenario, sessions=8, per_session=5, latency=0.2, jitter=0.1, token_rate=200.0,
+                 malformed_rate=0.1):
+    stub = StubConfig(latency=latency, jitter=jitter, token_rate=token_rate, malformed_rate=malformed_rate)
+    server = start_background(config=stub)
+    settings = _settings(server.server_address[1], scenario, sessions)
+    analyzer = Analyzer(settings.get)
+    targets = analyzer.targets()
+    job_queue = load_job_queue(settings.get, targets)
+
+    # The first call pays for the lazy SDK import and the connection pool; report it on its own
+    started = time.monotonic()
+    try:
+        analyzer.analyze("warm up", targets=targets)
+    except AnalysisFailed:
+        pass  # injected failures; the timing still counts
+    cold_start = time.monotonic() - started
+
+    lock = threading.Lock()
+    latencies, queue_waits, first_tokens = [], [], []
+    counters = {"done": 0, "failed": 0, "model_calls": 0, "repairs": 0}
+
+    def session(number):
+        for i in range(per_session):
+            notes = f"Session {number}, request {i}: we have a SAN and need to open a job."
+            first_token = []
+
+            def work(job):
+                def on_event(kind, value=None):
+                    job.on_event(kind, value)
+                    if kind == "reasoning" and not first_token:
+                        first_token.append(time.monotonic())
+                    elif kind == "attempt_stats":
+                        with lock:
+                            counters["model_calls"] += value["model_calls"]
+                            counters["repairs"] += value["repairs"]
+                return analyzer.analyze(notes, targets=targets, on_event=on_event, cancel_event=job.cancel_event,
+                                        hold=job.hold)
+
+            submitted = time.monotonic()
+            job = job_queue.submit(f"bench-{number}", f"Bench {number}-{i}", targets[0].name, work)
+            job.future.result()
+            finished = time.monotonic()
+            with lock:
+                counters["done" if job.result else "failed"] += 1
+                latencies.append(finished - submitted)
+                if job.started:
+                    queue_waits.append(job.started - job.created)
+                if first_token:
+                    first_tokens.append(first_token[0] - submitted)
+            job_queue.forget(job.id)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    server.shutdown()
+    server.server_close()
+    analyzer.close()
+
+    requests = sessions * per_session
+    return {
+        "scenario": scenario["name"],
+        "sessions": sessions,
+        "requests": requests,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 3) if wall else None,
+        "cold_start_seconds": round(cold_start, 3),
+        "latency": summarize(latencies, digits=4),  # seconds
+        "queue_wait": summarize(queue_waits, digits=4),
+        "first_token": summarize(first_tokens, digits=4),
+        "stub": {"latency": latency, "jitter": jitter, "token_rate": token_rate,
+                 "malformed_rate": malformed_rate, "requests": stub.requests, "malformed": stub.malformed},
+        **counters,
+    }
+
+
+def run_e2e_bench(scenarios=None, log=None, **options):
+    rows = []
+    for scenario in scenarios or DEFAULT_SCENARIOS:
+        row = run_scenario(scenario, **options)
+        rows.append(row)
+        if log is not None:
+            log(f"e2e {row['scenario']:16} {row['requests']} requests in {row['wall_seconds']}s "
+                f"({row['throughput_rps']} req/s), p50={row['latency'].get('p50')}s "
+                f"p95={row['latency'].get('p95')}s, failed={row['failed']}, repairs={row['repairs']}")
+    return rows
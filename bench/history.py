@@ -0,0 +1,130 @@
+# History store microbenchmarks: the operations behind get_unique_name, update_task_status,
+# delete_from_history (+ trash restore), rename_project_in_history and the sidebar search,
+# at several history sizes, on both backends.
+import json
+import os
+import sqlite3
+import tempfile
+
+from ophub.history import (HistoryStore, LocalStorageBackend, SqliteHistoryBackend, STORAGE_PREFIX,
+                           encode_entry, new_entry)
+
+from bench.stats import measure, summarize
+
+SIZES = (10, 1000, 100000)
+BACKENDS = ("local", "sqlite")
+TASKS_PER_ENTRY = 4
+
+
+class MemoryLocalStorage:
+    # Stands in for the browser: values are JSON encoded like the component does,
+    # and the bytes sent are counted
+
+    def __init__(self):
+        self.items = {}
+        self.bytes_written = 0
+        self.writes = 0
+
+    def getItem(self, item_key, key=None):
+        value = self.items.get(item_key)
+        return None if value is None else json.loads(value)
+
+    def getAll(self):
+        return {item_key: json.loads(value) for item_key, value in self.items.items()}
+
+    def setItem(self, item_key, value, key=None):
+        encoded = json.dumps(value)
+        self.items[item_key] = encoded
+        self.bytes_written += len(encoded)
+        self.writes += 1
+
+    def deleteItem(self, item_key, key=None):
+        self.items.pop(item_key, None)
+        self.writes += 1
+
+
+# Realistic names plus one heavily duplicated project ("Acme", "Acme (1)", ...),
+# which is the worst case for unique names. Oldest first.
+def make_entries(size):
+    duplicates = max(1, size // 10)
+    entries = []
+    for i in range(size):
+        if i < duplicates:
+            name = "Acme" if i == 0 else f"Acme ({i})"
+        else:
+            name = f"Client {i}"
+        tasks = [{"task": f"Task {t} for entry {i}", "done": t % 2 == 0} for t in range(TASKS_PER_ENTRY)]
+        entries.append(new_entry(name, f"Reasoning for entry {i}. " * 5, tasks))
+    return entries
+
+
+def _local_store(entries):
+    storage = MemoryLocalStorage()
+    for position, entry in enumerate(entries, 1):
+        storage.items[f"{STORAGE_PREFIX}:{entry['id']}"] = json.dumps(encode_entry(entry, float(position)))
+    return HistoryStore(LocalStorageBackend(storage)), storage
+
+
+def _sqlite_store(entries, folder):
+    path = os.path.join(folder, f"history_{len(entries)}.sqlite3")
+    SqliteHistoryBackend(path)  # creates the table
+    db = sqlite3.connect(path)
+    db.executemany(
+        "INSERT INTO history (id, position, project, reasoning, tasks) VALUES (?, ?, ?, ?, ?)",
+        [(e["id"], float(i + 1), e["project"], e["reasoning"], json.dumps(e["tasks"])) for i, e in enumerate(entries)],
+    )
+    db.commit()
+    db.close()
+    return HistoryStore(SqliteHistoryBackend(path)), None
+
+
+def _repeat(size):
+    return 200 if size <= 1000 else 50
+
+
+def bench_store(store, storage, size):
+    ids = [entry["id"] for entry in store.all()]
+    repeat = _repeat(size)
+    results = {}
+
+    def written():
+        return storage.bytes_written if storage is not None else None
+
+    def run(name, fn):
+        before = written()
+        durations = measure(fn, repeat)
+        results[name] = summarize(durations, digits=2)  # microseconds
+        if storage is not None:
+            results[name]["bytes_per_op"] = round((written() - before) / repeat)
+
+    run("unique_name", lambda i: store.unique_name("Acme"))
+    run("update_task", lambda i: store.update_task(ids[i % len(ids)], i % TASKS_PER_ENTRY, i % 2 == 0))
+    run("rename", lambda i: store.rename(ids[i % len(ids)], f"Renamed {i}"))
+
+    # delete + restore keeps the size constant between repetitions
+    def delete_restore(i):
+        deleted = store.delete(ids[(i * 7) % len(ids)])
+        store.restore(deleted)
+    run("delete_restore", delete_restore)
+
+    store.search("acme")  # builds the index once per session; not part of the timings
+    run("search", lambda i: store.search(f"entry {i}", limit=20))
+    return results
+
+
+def run_history_bench(sizes=SIZES, backends=BACKENDS, log=None):
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            entries = make_entries(size)
+            for backend in backends:
+                if backend == "local":
+                    store, storage = _local_store([dict(entry) for entry in entries])
+                else:
+                    store, storage = _sqlite_store(entries, folder)
+                operations = bench_store(store, storage, size)
+                rows.append({"backend": backend, "size": size, "operations": operations})
+                if log is not None:
+                    summary = ", ".join(f"{name} p50={op['p50']}us" for name, op in operations.items())
+                    log(f"history {backend:6} {size:>7}: {summary}")
+    return rows
@@ -0,0 +1,44 @@
+# Guide rule fast path: every case must resolve to the expected tasks (None: left to the model),
+# then resolve() is timed over all of them.
+from ophub.rules import compile_rules
+
+from bench.stats import measure, summarize
+
+GUIDE_PATH = "guide.txt"
+CASES = [
+    ("I need an open job, I only have a SAN and CA", ["Complete EA", "Obtain signed EL", "Open a job"]),
+    ("We have a SAN and need to open a job",
+     ["Request Client Acceptance", "Complete EA", "Obtain signed EL", "Open a job"]),
+    ("we have to open a job; SAN, CA, EA and signed EL are in place", ["Open a job"]),
+    ("client has EA already and wants to open a job", ["Obtain signed EL", "Open a job"]),
+    ("no SAN yet, we want to open a job",
+     ["Obtain SAN", "Request Client Acceptance", "Complete EA", "Obtain signed EL", "Open a job"]),
+    ("I have the SAN and I'm waiting for CA, need to open a job",
+     ["Request Client Acceptance", "Complete EA", "Obtain signed EL", "Open a job"]),
+    # Not covered by the rules: these must reach the model
+    ("I need to open a job and I have everything except the EA", None),
+    ("The CA was rejected by KYC and the SAN has expired, we need to open a job", None),
+    ("we need to schedule the audit and open a job, we have a SAN", None),
+    ("Please summarize the client meeting", None),
+    ("the SAN has expired, need to open a job", None),
+    ("I have a SAN, the CA is not approved, need an EA", None),
+    ("I have an EL but it is not signed, need to open a job", None),
+    ("I have an EL, need to open a job", None),  # an EL is not a signed EL
+]
+
+
+def run_rules_bench(guide_path=GUIDE_PATH, repeat=2000, log=None):
+    with open(guide_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    compile_us = measure(lambda i: compile_rules(text), 50)
+    rules = compile_rules(text)
+    for notes, expected in CASES:
+        answer = rules.resolve(notes)
+        assert (answer and answer["tasks"]) == expected, (notes, answer)
+    resolve_us = measure(lambda i: rules.resolve(CASES[i % len(CASES)][0]), repeat)
+    row = {"items": len(rules), "cases": len(CASES), "compile": summarize(compile_us, digits=2),
+           "resolve": summarize(resolve_us, digits=2)}
+    if log is not None:
+        log(f"rules   {row['items']} items, {row['cases']} cases: compile p50={row['compile']['p50']}us, "
+            f"resolve p50={row['resolve']['p50']}us p95={row['resolve']['p95']}us")
+    return row
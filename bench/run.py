@@ -0,0 +1,134 @@
+# Runs the benchmarks and stores the numbers as JSON for regression comparison.
+#
+#   python -m bench.run                                  # everything, results in bench/results/
+#   python -m bench.run --quick --skip-e2e               # history + storage formats + guide rules, small sizes
+#   python -m bench.run --compare bench/results/baseline.json --fail-on-regression
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from bench.e2e import run_e2e_bench
+from bench.history import SIZES, run_history_bench
+from bench.rules import run_rules_bench
+from bench.storage_format import run_format_bench
+
+DEFAULT_OUTPUT_DIR = os.path.join("bench", "results")
+QUICK_SIZES = (10, 1000)
+REGRESSION_RATIO = 1.25  # slower than this x the baseline is reported
+# ...and by more than this much, so timer noise on tiny numbers isn't reported
+NOISE_FLOOR = {"history": 20.0, "format": 0.5, "rules": 20.0, "e2e": 0.02}  # microseconds, seconds
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Flat {"history/local/1000/unique_name/p50": value, ...} for comparing two runs (lower is better)
+def flatten(results):
+    metrics = {}
+    for row in results.get("history", []):
+        for name, op in row["operations"].items():
+            for stat in ("p50", "p95"):
+                metrics[f"history/{row['backend']}/{row['size']}/{name}/{stat}"] = op.get(stat)
+    for row in results.get("format", []):
+        for stat in ("bytes_per_entry", "insert_bytes", "toggle_bytes", "encode_us_per_entry", "decode_us_per_entry"):
+            metrics[f"format/{row['format']}/{row['size']}/{stat}"] = row[stat]
+    if "rules" in results:
+        for group in ("compile", "resolve"):
+            for stat in ("p50", "p95"):
+                metrics[f"rules/{group}/{stat}"] = results["rules"][group].get(stat)
+    for row in results.get("e2e", []):
+        for group in ("latency", "first_token", "queue_wait"):
+            for stat in ("p50", "p95"):
+                metrics[f"e2e/{row['scenario']}/{group}/{stat}"] = row[group].get(stat)
+    return {key: value for key, value in metrics.items() if value is not None}
+
+
+def compare(current, baseline, ratio=REGRESSION_RATIO):
+    new, old = flatten(current), flatten(baseline)
+    regressions, improvements = [], []
+    for key in sorted(set(new) & set(old)):
+        if not old[key] or abs(new[key] - old[key]) < NOISE_FLOOR[key.split("/")[0]]:
+            continue
+        change = new[key] / old[key]
+        if change > ratio:
+            regressions.append((key, old[key], new[key], change))
+        elif change < 1 / ratio:
+            improvements.append((key, old[key], new[key], change))
+    return regressions, improvements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="History and analysis benchmarks")
+    parser.add_argument("--quick", action="store_true", help="small sizes and fewer requests")
+    parser.add_argument("--skip-history", action="store_true")
+    parser.add_argument("--skip-format", action="store_true", help="skip the LocalStorage format comparison")
+    parser.add_argument("--skip-rules", action="store_true", help="skip the guide rule checks and timings")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions (e2e)")
+    parser.add_argument("--per-session", type=int, default=5, help="analyses per session (e2e)")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock time to first byte (seconds)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="mock tokens per second")
+    parser.add_argument("--malformed-rate", type=float, default=0.1, help="mock fraction of broken JSON answers")
+    parser.add_argument("--output", help="results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    log = lambda message: print(message, file=sys.stderr)
+    results = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+        },
+    }
+    if not args.skip_history:
+        results["history"] = run_history_bench(QUICK_SIZES if args.quick else SIZES, log=log)
+    if not args.skip_format:
+        results["format"] = run_format_bench(QUICK_SIZES if args.quick else SIZES, log=log)
+    if not args.skip_rules:
+        results["rules"] = run_rules_bench(log=log)
+    if not args.skip_e2e:
+        results["e2e"] = run_e2e_bench(
+            log=log,
+            sessions=2 if args.quick else args.sessions,
+            per_session=2 if args.quick else args.per_session,
+            latency=args.latency,
+            token_rate=args.token_rate,
+            malformed_rate=args.malformed_rate,
+        )
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    folder = os.path.dirname(output)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    log(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, improvements = compare(results, baseline)
+        for key, old, new, change in improvements:
+            log(f"faster  {key}: {old} -> {new} (x{change:.2f})")
+        for key, old, new, change in regressions:
+            log(f"SLOWER  {key}: {old} -> {new} (x{change:.2f})")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+import time
+
+from ophub.metrics import percentile
+
+
+# {"n", "mean", "p50", "p95", "p99", "max"} in the unit the values are in
+def summarize(values, digits=6):
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), digits),
+        "p50": round(percentile(values, 50), digits),
+        "p95": round(percentile(values, 95), digits),
+        "p99": round(percentile(values, 99), digits),
+        "max": round(max(values), digits),
+    }
+
+
+# Runs fn(i) repeat times, returns the durations in microseconds
+def measure(fn, repeat):
+    durations = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        durations.append((time.perf_counter() - started) * 1e6)
+    return durations
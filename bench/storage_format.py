@@ -0,0 +1,112 @@
+# LocalStorage payload formats: size of the whole history and of one task toggle, and
+# encode/decode speed, for
+#   v1  the whole list as one JSON value
+#   v2  one JSON dict per entry + an id index
+#   v3  one compact string per entry (parallel task arrays, done bitset, zlib+base64) holding its
+#       position, no index
+import json
+import random
+import time
+
+from ophub.history import decode_record, encode_entry, new_entry
+
+from bench.history import TASKS_PER_ENTRY
+
+SIZES = (10, 1000, 100000)
+FORMATS = ("v1", "v2", "v3")
+WORDS = ("the", "site", "survey", "permit", "install", "check", "client", "network", "cabling", "order",
+         "schedule", "contract", "storage", "SAN", "switch", "rack", "power", "backup", "licence", "review",
+         "before", "after", "needs", "with", "for", "and", "to", "of", "a", "team")
+
+
+# Model answers rather than make_entries' repeated sentence, which would compress unrealistically well
+def make_entries(size, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(size):
+        reasoning = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + "."
+        tasks = [{"task": " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))).capitalize(),
+                  "done": rng.random() < 0.5} for _ in range(TASKS_PER_ENTRY)]
+        entries.append(new_entry(f"Client {i}", reasoning, tasks))
+    return entries
+
+
+# Stored strings per format ({key: value} as the component keeps them, i.e. JSON encoded)
+def encode(entries, fmt):
+    if fmt == "v1":
+        return {"history": json.dumps(entries)}
+    if fmt == "v2":
+        items = {entry["id"]: json.dumps(entry) for entry in entries}
+        items["index"] = json.dumps([entry["id"] for entry in entries])
+        return items
+    return {entry["id"]: json.dumps(encode_entry(entry, float(position))) for position, entry in enumerate(entries, 1)}
+
+
+def decode(items, fmt):
+    if fmt == "v1":
+        return json.loads(items["history"])
+    if fmt == "v2":
+        return [json.loads(items[entry_id]) for entry_id in json.loads(items["index"])]
+    records = sorted((decode_record(json.loads(value)) for value in items.values()), key=lambda record: record[1])
+    return [entry for entry, _ in records]
+
+
+# What one checkbox click sends to the browser
+def toggle_bytes(entries, fmt):
+    entry = entries[len(entries) // 2]
+    entry["tasks"][0]["done"] = not entry["tasks"][0]["done"]
+    if fmt == "v1":
+        return len(json.dumps(entries))
+    if fmt == "v2":
+        return len(json.dumps(entry))
+    return len(json.dumps(encode_entry(entry, 1.0)))
+
+
+# What creating one project sends to the browser
+def insert_bytes(entries, fmt):
+    entry = new_entry("New project", entries[0]["reasoning"], entries[0]["tasks"])
+    if fmt == "v1":
+        return len(json.dumps([entry] + entries))
+    if fmt == "v2":
+        return len(json.dumps(entry)) + len(json.dumps([entry["id"]] + [e["id"] for e in entries]))
+    return len(json.dumps(encode_entry(entry, len(entries) + 1.0)))
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_format_bench(sizes=SIZES, formats=FORMATS, log=None):
+    rows = []
+    for size in sizes:
+        entries = make_entries(size)
+        repeat = 5 if size <= 1000 else 1
+        for fmt in formats:
+            encode_seconds, items = _best_of(lambda: encode(entries, fmt), repeat)
+            decode_seconds, decoded = _best_of(lambda: decode(items, fmt), repeat)
+            assert decoded == entries, fmt
+            total = sum(len(value) for value in items.values())
+            row = {
+                "format": fmt,
+                "size": size,
+                "bytes": total,
+                "bytes_per_entry": round(total / size),
+                "insert_bytes": insert_bytes(entries, fmt),
+                "toggle_bytes": toggle_bytes([dict(entry, tasks=[dict(t) for t in entry["tasks"]]) for entry in entries], fmt),
+                "encode_us_per_entry": round(encode_seconds / size * 1e6, 2),
+                "decode_us_per_entry": round(decode_seconds / size * 1e6, 2),
+                "encode_mb_per_s": round(total / encode_seconds / 1e6, 1),
+                "decode_mb_per_s": round(total / decode_seconds / 1e6, 1),
+            }
+            rows.append(row)
+            if log is not None:
+                log(f"format  {fmt} {size:>7}: {row['bytes_per_entry']} B/entry, insert {row['insert_bytes']} B, "
+                    f"toggle {row['toggle_bytes']} B, "
+                    f"encode {row['encode_us_per_entry']}us, decode {row['decode_us_per_entry']}us per entry")
+    return rows
@@ -0,0 +1 @@
+# Core helpers for the AI Operational Hub (no Streamlit imports in here)
@@ -0,0 +1,116 @@
+import threading
+
+from ophub.clients import ClientRegistry
+from ophub.config import (env_secret, is_enabled, kb_top_k, load_analysis_options, load_context_cache,
+                          load_knowledge_base, load_response_cache, load_similar_notes, similar_mode)
+from ophub.engine import run_analysis
+from ophub.similar import AUTO, OFF
+from ophub.providers import LatencyTracker, load_providers
+
+
+class Analyzer:
+    # The UI-free entry point: long-lived resources (client pools, caches, guide index, latency
+    # window) live here and are shared by every caller. Settings are read through get_secret on
+    # each call, so changed settings apply to the next analysis.
+    # Progress comes back through on_event(kind, value), see ophub.engine.run_analysis.
+
+    def __init__(self, get_secret=env_secret, guide_path=None):
+        self.get_secret = get_secret
+        self.guide_path = guide_path
+        self.client_registry = ClientRegistry()
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._resources = {}
+
+    def _resource(self, name, load):
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = load()
+            return self._resources[name]
+
+    @property
+    def response_cache(self):
+        return self._resource("response_cache", lambda: load_response_cache(self.get_secret))
+
+    @property
+    def context_cache(self):
+        return self._resource("context_cache", lambda: load_context_cache(self.get_secret))
+
+    @property
+    def similar_notes(self):
+        return self._resource("similar_notes", lambda: load_similar_notes(self.get_secret))
+
+    @property
+    def knowledge_base(self):
+        return self._resource("knowledge_base", lambda: load_knowledge_base(self.get_secret, self.guide_path))
+
+    # Ordered backends (settings read once per analysis, not on every retry)
+    def targets(self):
+        return load_providers(self.get_secret)
+
+    # Only the guide sections relevant to these notes (the whole guide while it is small).
+    # With the Gemini context cache on and Gemini as the primary backend, always the whole guide:
+    # it is uploaded into the cache once and then billed at the cached rate, where top-k chunks
+    # would change with every notes and could not be cached. (Backends after it in the failover
+    # order get the whole guide inline.)
+    def select_guide(self, notes, targets=None):
+        targets = targets or self.targets()
+        if is_enabled(self.get_secret, "AI_CONTEXT_CACHE") and targets[0].provider == "gemini":
+            self.knowledge_base.refresh()
+            return self.knowledge_base.full_text()
+        return self.knowledge_base.select(notes, kb_top_k(self.get_secret))
+
+    # The earlier analysis of near-identical notes (same guide), or None.
+    # For AI_SIMILAR_MODE=offer, where the user picks before anything is sent to a model.
+    def find_similar(self, notes, kb=None):
+        if similar_mode(self.get_secret) == OFF:
+            return None
+        return self.similar_notes.best(kb if kb is not None else self.select_guide(notes), notes)
+
+    # Blocking; returns {"reasoning", "tasks", "provider"} or raises AnalysisFailed / AnalysisCancelled.
+    # use_cache=False skips the response cache, the similar-notes reuse and the guide rules
+    # (the "Force fresh analysis" box).
+    def analyze(self, notes, kb=None, targets=None, use_cache=True, on_event=None, cancel_event=None,
+                hold=None):
+        get_secret = self.get_secret
+        targets = targets or self.targets()
+        if kb is None:
+            kb = self.select_guide(notes, targets)
+        response_cache = None
+        if use_cache and is_enabled(get_secret, "AI_CACHE_ENABLED"):
+            response_cache = self.response_cache
+        # Only the whole guide is worth a Gemini cached content (see select_guide): top-k chunks
+        # differ per notes, so every analysis would create (and pay for) a new cache
+        context_cache = None
+        if is_enabled(get_secret, "AI_CONTEXT_CACHE") and kb == self.knowledge_base.full_text():
+            context_cache = self.context_cache
+        mode = similar_mode(get_secret)
+        rules = None
+        if use_cache and is_enabled(get_secret, "AI_RULES", default="0"):  # AI_RULES=1: rules before the model
+            rules = self.knowledge_base.rules()
+        similar_notes = self.similar_notes if mode != OFF else None
+        return run_analysis(
+            kb, notes, targets, self.client_registry,
+            response_cache=response_cache,
+            latency=self.latency,
+            context_cache=context_cache,
+            similar_notes=similar_notes,
+            reuse_similar=use_cache and mode == AUTO,
+            rules=rules,
+            on_event=on_event,
+            cancel_event=cancel_event,
+            hold=hold,
+            **load_analysis_options(get_secret),
+        )
+
+    # Health of the shared resources (only the ones already in use)
+    def stats(self):
+        with self._lock:
+            resources = dict(self._resources)
+        stats = {"clients": self.client_registry.stats(), "latency": self.latency.stats()}
+        for name, resource in resources.items():
+            stats[name] = resource.stats()
+        return stats
+
+    def close(self):
+        self.client_registry.close_all()
@@ -0,0 +1,206 @@
+# Headless batch analysis: many (project, notes) pairs in one go, no Streamlit.
+#
+#   python -m ophub.batch month_end.jsonl --concurrency 4 --rate 30 --summary summary.json
+#
+# Input is JSONL ({"project": ..., "notes": ...} per line) or CSV with project,notes columns.
+# Results go into the SQLite history (HISTORY_DB_PATH) as they finish, in the usual
+# {"id", "project", "reasoning", "tasks"} schema; --export also writes a history_log.json style
+# file that can be loaded with the app's Import button.
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ophub.analysis import Analyzer
+from ophub.config import configure_metrics, env_secret, history_db_path, history_trash_days, setting
+from ophub.engine import AnalysisFailed
+from ophub.history import HistoryStore, SqliteHistoryBackend, new_entry, write_history_file
+from ophub.metrics import metrics, percentile
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE = 30  # analyses started per minute
+
+
+# Rows as {"line", "project", "notes"}; rows that cannot be used keep an "error"
+def read_items(path):
+    items = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = ((number, row) for number, row in enumerate(csv.DictReader(f), 2))
+        else:
+            rows = []
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append((number, json.loads(line)))
+                except ValueError as e:
+                    rows.append((number, {"error": f"invalid JSON: {e}"}))
+        for number, row in rows:
+            item = {
+                "line": number,
+                "project": str(row.get("project") or "").strip(),
+                "notes": str(row.get("notes") or "").strip(),
+            }
+            if row.get("error"):
+                item["error"] = row["error"]
+            elif not item["project"] or not item["notes"]:
+                item["error"] = "project and notes are required"
+            items.append(item)
+    return items
+
+
+class RateLimiter:
+    # Spaces out starts evenly: at most per_minute calls to acquire() return per minute
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self, cancel_event=None):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        delay = start - now
+        if delay > 0:
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+def run_batch(items, history, analyzer, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+              use_cache=True, log=None):
+    targets = analyzer.targets()
+    limiter = RateLimiter(rate)
+    cancel_event = threading.Event()
+
+    def analyze(item):
+        limiter.acquire(cancel_event)
+        result = {"line": item["line"], "project": item["project"], "status": "failed"}
+        events, entry = {}, None  # last value per event kind
+        started = time.monotonic()
+        try:
+            answer = analyzer.analyze(
+                item["notes"],
+                targets=targets,
+                use_cache=use_cache,
+                on_event=lambda kind, value=None: events.__setitem__(kind, value),
+                cancel_event=cancel_event,
+            )
+        except Exception as e:
+            result["error"] = str(e) if isinstance(e, AnalysisFailed) else f"{type(e).__name__}: {e}"
+        else:
+            tasks = [{"task": name, "done": False} for name in answer["tasks"]]
+            with metrics.time("save"):
+                entry = history.add(new_entry(history.unique_name(item["project"]), answer["reasoning"], tasks))
+            result.update(
+                status="done",
+                entry_id=entry["id"],
+                saved_as=entry["project"],
+                provider=answer.get("provider"),
+                tasks=len(tasks),
+                cache_hit="cache_hit" in events,
+                similar_hit="similar_hit" in events,
+                rules_hit="rules_hit" in events,
+            )
+        if "trace" in events:
+            result["stages"] = events["trace"]["stages"]
+            result["usage"] = events["trace"]["usage"]
+        result["latency"] = round(time.monotonic() - started, 3)
+        return result, entry
+
+    results, entries = [], []
+    started = time.time()
+    for item in items:
+        if item.get("error"):
+            results.append({"line": item["line"], "project": item["project"], "status": "skipped",
+                            "error": item["error"], "latency": 0.0})
+    runnable = [item for item in items if not item.get("error")]
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(analyze, item) for item in runnable]
+        for done_count, future in enumerate(as_completed(futures), 1):
+            result, entry = future.result()
+            results.append(result)
+            if entry is not None:
+                entries.append(entry)
+            if log is not None:
+                log(f"[{done_count}/{len(runnable)}] {result['project']}: {result['status']} "
+                    f"({result['latency']}s){' - ' + result['error'] if result.get('error') else ''}")
+    except KeyboardInterrupt:
+        cancel_event.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    results.sort(key=lambda result: result["line"])
+    latencies = [result["latency"] for result in results if result["status"] == "done"]
+    summary = {
+        "total": len(items),
+        "done": sum(result["status"] == "done" for result in results),
+        "failed": sum(result["status"] == "failed" for result in results),
+        "skipped": sum(result["status"] == "skipped" for result in results),
+        "cache_hits": sum(bool(result.get("cache_hit")) for result in results),
+        "similar_hits": sum(bool(result.get("similar_hit")) for result in results),
+        "rules_hits": sum(bool(result.get("rules_hit")) for result in results),
+        "wall_seconds": round(time.time() - started, 3),
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies) if latencies else None,
+        },
+        "providers": analyzer.latency.stats(),
+        "metrics": metrics.snapshot(),
+        "items": results,
+    }
+    return summary, entries
+
+
+def main(argv=None):
+    get_secret = env_secret
+    parser = argparse.ArgumentParser(description="Analyze many project notes without the UI")
+    parser.add_argument("input", help="JSONL or CSV file with project and notes")
+    parser.add_argument("--concurrency", type=int,
+                        default=setting(get_secret, "AI_BATCH_CONCURRENCY", DEFAULT_CONCURRENCY, int))
+    parser.add_argument("--rate", type=float, default=setting(get_secret, "AI_BATCH_RATE", DEFAULT_RATE, float),
+                        help="analyses started per minute (0 = no limit)")
+    parser.add_argument("--history-db", default=history_db_path(get_secret))
+    parser.add_argument("--export", help="also write the new entries to this history_log.json style file")
+    parser.add_argument("--summary", help="write the summary JSON here (default: stdout)")
+    parser.add_argument("--guide", help="guide file or folder (default: AI_GUIDE_PATH or guide.txt)")
+    parser.add_argument("--no-cache", action="store_true", help="skip the response cache")
+    args = parser.parse_args(argv)
+
+    configure_metrics(get_secret)
+    items = read_items(args.input)
+    history = HistoryStore(SqliteHistoryBackend(args.history_db, trash_days=history_trash_days(get_secret)))
+    analyzer = Analyzer(get_secret, guide_path=args.guide)
+    try:
+        summary, entries = run_batch(
+            items, history, analyzer,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            use_cache=not args.no_cache,
+            log=lambda message: print(message, file=sys.stderr),
+        )
+    finally:
+        analyzer.close()
+
+    if args.export:
+        write_history_file(args.export, [dict(entry) for entry in reversed(entries)])  # newest first
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+    else:
+        print(json.dumps(summary, indent=4, ensure_ascii=False))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
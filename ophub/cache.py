@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults (overridable with AI_CACHE_PATH, AI_CACHE_TTL, AI_CACHE_MEMORY_ITEMS, AI_CACHE_DISK_ITEMS)
+DEFAULT_CACHE_PATH = os.path.join(".cache", "analysis_cache.sqlite3")
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+DEFAULT_MEMORY_ITEMS = 256
+DEFAULT_DISK_ITEMS = 5000
+
+
+# Same notes typed with different spacing/line endings should hit the same entry
+def normalize_notes(notes):
+    return re.sub(r"\s+", " ", notes or "").strip()
+
+
+# Content-addressed key: every input that can change the model output
+def make_cache_key(model, kb, notes, system_instruction, temperature):
+    payload = json.dumps(
+        [model, kb or "", normalize_notes(notes), system_instruction, float(temperature)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Two tiers: in-memory LRU in front of a SQLite table
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL,
+                 max_memory_items=DEFAULT_MEMORY_ITEMS, max_disk_items=DEFAULT_DISK_ITEMS):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                created, value = self._memory[key]
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        value = json.loads(row[0])
+                        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, row[1], value)
+                        self.hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict_disk(now)
+            self._db.commit()
+
+    # TTL first, then least recently used rows beyond the size limit
+    def _evict_disk(self, now):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_items,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            disk_items = 0
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "disk_items": disk_items,
+            }
@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import namedtuple
+
+# Pool defaults (overridable with AI_POOL_SIZE, AI_TIMEOUT, AI_CONNECT_TIMEOUT, AI_KEEPALIVE_EXPIRY)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# A client is dropped and rebuilt after this many connection failures in a row
+MAX_CONSECUTIVE_FAILURES = 3
+
+# httpx / SDK error types that mean the socket or pool is broken (matched on class names, so
+# neither SDK is imported). Read timeouts, 429s and 4xx/5xx answers come over a working
+# connection and don't count.
+CONNECTION_ERRORS = {
+    "ConnectError", "ConnectTimeout", "PoolTimeout", "ReadError", "WriteError", "RemoteProtocolError",
+    "LocalProtocolError", "NetworkError", "APIConnectionError", "ConnectionError",
+}
+SLOW_ERRORS = {"ReadTimeout", "WriteTimeout", "APITimeoutError", "TimeoutError"}
+
+# Everything that identifies one pooled client (hashable, used as registry key)
+ClientSettings = namedtuple(
+    "ClientSettings",
+    ["provider", "api_key", "base_url", "pool_size", "timeout", "connect_timeout", "keepalive_expiry"],
+)
+
+
+def _number(value, default, cast=float):
+    try:
+        return cast(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+
+# Read the connection settings once per analysis instead of once per attempt
+def load_client_settings(provider, get_secret):
+    return ClientSettings(
+        provider=provider,
+        api_key=get_secret("AI_API_KEY"),
+        base_url=get_secret("AI_BASE_URL") if provider == "openai" else None,
+        pool_size=_number(get_secret("AI_POOL_SIZE"), DEFAULT_POOL_SIZE, int),
+        timeout=_number(get_secret("AI_TIMEOUT"), DEFAULT_TIMEOUT),
+        connect_timeout=_number(get_secret("AI_CONNECT_TIMEOUT"), DEFAULT_CONNECT_TIMEOUT),
+        keepalive_expiry=_number(get_secret("AI_KEEPALIVE_EXPIRY"), DEFAULT_KEEPALIVE_EXPIRY),
+    )
+
+
+# Shared keep-alive HTTP pool used underneath both SDKs
+def _build_http_client(settings):
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.pool_size,
+            max_keepalive_connections=settings.pool_size,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(settings.timeout, connect=settings.connect_timeout),
+    )
+
+
+def _build_gemini(settings, http_client):
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        api_key=settings.api_key,
+        http_options=types.HttpOptions(
+            base_url=settings.base_url,  # None = Google endpoint (set for proxies / the stub server)
+            timeout=int(settings.timeout * 1000),  # milliseconds
+            httpx_client=http_client,
+        ),
+    )
+
+
+def _build_openai(settings, http_client):
+    from openai import OpenAI
+
+    return OpenAI(
+        base_url=settings.base_url,
+        api_key=settings.api_key,
+        timeout=settings.timeout,
+        max_retries=0,  # ophub.engine owns retries (backoff + error classification)
+        http_client=http_client,
+    )
+
+
+def is_connection_error(error):
+    seen = set()
+    while error is not None and id(error) not in seen:  # the SDKs wrap the httpx error
+        seen.add(id(error))
+        names = {cls.__name__ for cls in type(error).__mro__}
+        if names & SLOW_ERRORS:
+            return False
+        if names & CONNECTION_ERRORS:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+BUILDERS = {
+    "gemini": _build_gemini,
+    "openai": _build_openai,
+}
+
+
+def _close(http_client):
+    try:
+        http_client.close()
+    except Exception:
+        pass
+
+
+class ClientRegistry:
+    # Process-wide cache of SDK clients, one per ClientSettings.
+    # acquire()/release() count the calls using each client, so an evicted client other
+    # threads are still streaming on is only closed when the last of them is done.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}  # settings -> (sdk client, httpx client)
+        self._stats = {}  # settings -> counters
+        self._leases = {}  # id(sdk client) -> calls in flight
+        self._retired = {}  # id(sdk client) -> httpx client to close once its leases reach 0
+
+    def _counters(self, settings):
+        if settings not in self._stats:
+            self._stats[settings] = {
+                "created": 0,
+                "reused": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "evictions": 0,
+                "last_error": None,
+                "last_used": None,
+            }
+        return self._stats[settings]
+
+    def get(self, settings):
+        with self._lock:
+            counters = self._counters(settings)
+            counters["last_used"] = time.time()
+            if settings in self._clients:
+                counters["reused"] += 1
+                return self._clients[settings][0]
+
+            http_client = _build_http_client(settings)
+            try:
+                client = BUILDERS[settings.provider](settings, http_client)
+            except Exception:
+                http_client.close()
+                raise
+            self._clients[settings] = (client, http_client)
+            counters["created"] += 1
+            return client
+
+    # get() for one call; pair it with release(client) when the call is over
+    def acquire(self, settings):
+        client = self.get(settings)
+        with self._lock:
+            self._leases[id(client)] = self._leases.get(id(client), 0) + 1
+        return client
+
+    def release(self, client):
+        with self._lock:
+            left = self._leases.get(id(client), 0) - 1
+            if left > 0:
+                self._leases[id(client)] = left
+                return
+            self._leases.pop(id(client), None)
+            http_client = self._retired.pop(id(client), None)
+        if http_client is not None:
+            _close(http_client)
+
+    def report_success(self, settings):
+        with self._lock:
+            self._counters(settings)["consecutive_failures"] = 0
+
+    # Broken sockets / bad pools get thrown away so the next get() starts clean.
+    # Any other error means the server answered, so the connection is fine.
+    def report_failure(self, settings, error):
+        with self._lock:
+            counters = self._counters(settings)
+            counters["failures"] += 1
+            counters["last_error"] = f"{type(error).__name__}: {error}"
+            if not is_connection_error(error):
+                counters["consecutive_failures"] = 0
+                return
+            counters["consecutive_failures"] += 1
+            if counters["consecutive_failures"] >= MAX_CONSECUTIVE_FAILURES:
+                self._evict(settings)
+                counters["consecutive_failures"] = 0
+
+    # Drops the client from the registry; closes it now only if nobody is using it
+    def _evict(self, settings):
+        entry = self._clients.pop(settings, None)
+        if entry is None:
+            return
+        self._stats[settings]["evictions"] += 1
+        if self._leases.get(id(entry[0])):
+            self._retired[id(entry[0])] = entry[1]
+        else:
+            _close(entry[1])
+
+    # Idle clients close now, the ones still in use when their last call releases them
+    def close_all(self):
+        with self._lock:
+            for settings in list(self._clients):
+                self._evict(settings)
+
+    # Health snapshot (api keys are never included)
+    def stats(self):
+        with self._lock:
+            snapshot = []
+            for settings, counters in self._stats.items():
+                row = dict(counters)
+                row["provider"] = settings.provider
+                row["base_url"] = settings.base_url
+                row["pool_size"] = settings.pool_size
+                row["alive"] = settings in self._clients
+                snapshot.append(row)
+            return snapshot
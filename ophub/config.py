@@ -0,0 +1,172 @@
+import json
+import os
+import sys
+import threading
+
+from ophub.cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_TTL, DEFAULT_MEMORY_ITEMS, DEFAULT_DISK_ITEMS
+from ophub.context_cache import ContextCache, DEFAULT_TTL as DEFAULT_CONTEXT_TTL, DEFAULT_MIN_CHARS
+from ophub.engine import DEFAULT_FAILOVER_ATTEMPTS, DEFAULT_HEDGE_DELAY
+from ophub.history import DEFAULT_DB_PATH, DEFAULT_PAGE_SIZE, DEFAULT_TRASH_DAYS, DEFAULT_WRITE_DELAY
+from ophub.jobs import JobQueue, DEFAULT_MAX_WORKERS, DEFAULT_PROVIDER_LIMIT, limit_name
+from ophub.knowledge import KnowledgeBase, DEFAULT_GUIDE_PATH, DEFAULT_INDEX_PATH, DEFAULT_TOP_K, DEFAULT_CHUNK_CHARS, DEFAULT_FULL_CHARS
+from ophub.metrics import JsonLogSink, metrics, start_metrics_server
+from ophub.retry import RetryPolicy, DEFAULT_MAX_ATTEMPTS, DEFAULT_BASE_DELAY, DEFAULT_MAX_DELAY
+from ophub.similar import SimilarNotes, DEFAULT_SIMILAR_PATH, DEFAULT_THRESHOLD, DEFAULT_MAX_ITEMS, OFF, OFFER, AUTO
+
+# Every setting is read through a get_secret(key) callable: env_secret below, or the app's
+# Streamlit-secrets-then-env lookup. Nothing here reads settings at import time.
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+
+# .env is read on first use instead of when a module is imported
+def load_env():
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            _env_loaded = True
+
+
+def env_secret(key):
+    load_env()
+    return os.getenv(key)
+
+
+def is_enabled(get_secret, key, default="1"):
+    return str(get_secret(key) or default).lower() not in ("0", "false", "no", "off")
+
+
+def setting(get_secret, key, default, cast=str):
+    value = get_secret(key)
+    return default if value in (None, "") else cast(value)
+
+
+def load_response_cache(get_secret):
+    return ResponseCache(
+        path=setting(get_secret, "AI_CACHE_PATH", DEFAULT_CACHE_PATH),
+        ttl=setting(get_secret, "AI_CACHE_TTL", DEFAULT_TTL, float),
+        max_memory_items=setting(get_secret, "AI_CACHE_MEMORY_ITEMS", DEFAULT_MEMORY_ITEMS, int),
+        max_disk_items=setting(get_secret, "AI_CACHE_DISK_ITEMS", DEFAULT_DISK_ITEMS, int),
+    )
+
+
+# Earlier analyses for near-identical notes (ophub.similar):
+#   AI_SIMILAR_MODE       off (default), offer (ask before analyzing) or auto (reuse without asking)
+#   AI_SIMILAR_THRESHOLD  cosine similarity needed for a match, 0-1
+def similar_mode(get_secret):
+    mode = str(get_secret("AI_SIMILAR_MODE") or OFF).lower()
+    return mode if mode in (OFFER, AUTO) else OFF
+
+
+def load_similar_notes(get_secret):
+    return SimilarNotes(
+        path=setting(get_secret, "AI_SIMILAR_PATH", DEFAULT_SIMILAR_PATH),
+        threshold=setting(get_secret, "AI_SIMILAR_THRESHOLD", DEFAULT_THRESHOLD, float),
+        max_items=setting(get_secret, "AI_SIMILAR_MAX_ITEMS", DEFAULT_MAX_ITEMS, int),
+    )
+
+
+# Gemini cached contents for the guide (AI_CONTEXT_CACHE, on by default). Guides shorter than
+# AI_CONTEXT_CACHE_MIN_CHARS are sent inline; longer ones go whole into the cache, even past
+# AI_KB_FULL_CHARS (see Analyzer.select_guide).
+def load_context_cache(get_secret):
+    return ContextCache(
+        ttl=setting(get_secret, "AI_CONTEXT_CACHE_TTL", DEFAULT_CONTEXT_TTL, float),
+        min_chars=setting(get_secret, "AI_CONTEXT_CACHE_MIN_CHARS", DEFAULT_MIN_CHARS, int),
+    )
+
+
+def load_knowledge_base(get_secret, path=None):
+    return KnowledgeBase(
+        path=path or setting(get_secret, "AI_GUIDE_PATH", DEFAULT_GUIDE_PATH),
+        index_path=setting(get_secret, "AI_KB_INDEX_PATH", DEFAULT_INDEX_PATH),
+        chunk_chars=setting(get_secret, "AI_KB_CHUNK_CHARS", DEFAULT_CHUNK_CHARS, int),
+        full_chars=setting(get_secret, "AI_KB_FULL_CHARS", DEFAULT_FULL_CHARS, int),
+    )
+
+
+# Backoff for network errors / 429s, fail fast on auth errors, local JSON repair first
+def load_retry_policy(get_secret):
+    return RetryPolicy(
+        max_attempts=setting(get_secret, "AI_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS, int),
+        base_delay=setting(get_secret, "AI_RETRY_BASE_DELAY", DEFAULT_BASE_DELAY, float),
+        max_delay=setting(get_secret, "AI_RETRY_MAX_DELAY", DEFAULT_MAX_DELAY, float),
+    )
+
+
+# run_analysis keyword arguments that come straight from settings
+def load_analysis_options(get_secret):
+    return {
+        "streaming": is_enabled(get_secret, "AI_STREAMING"),  # AI_STREAMING=0 for blocking calls
+        "retry_policy": load_retry_policy(get_secret),
+        "hedge": is_enabled(get_secret, "AI_HEDGE", default="0"),
+        "hedge_delay": setting(get_secret, "AI_HEDGE_DELAY", DEFAULT_HEDGE_DELAY, float),
+        "failover_attempts": setting(get_secret, "AI_FAILOVER_ATTEMPTS", DEFAULT_FAILOVER_ATTEMPTS, int),
+        "keep_alive": get_secret("AI_KEEP_ALIVE"),  # e.g. 30m, keeps the Ollama model loaded
+    }
+
+
+def load_job_queue(get_secret, targets):
+    limits = {}
+    for target in targets:
+        # AI_MAX_CONCURRENCY_GEMINI_2_5_FLASH for one backend, else AI_MAX_CONCURRENCY_GEMINI / _OPENAI
+        value = (get_secret(f"AI_MAX_CONCURRENCY_{limit_name(target.name)}")
+                 or get_secret(f"AI_MAX_CONCURRENCY_{target.provider.upper()}"))
+        if value:
+            limits[target.name] = int(value)
+    return JobQueue(
+        max_workers=setting(get_secret, "AI_MAX_WORKERS", DEFAULT_MAX_WORKERS, int),
+        provider_limits=limits,
+        default_limit=setting(get_secret, "AI_MAX_CONCURRENCY", DEFAULT_PROVIDER_LIMIT, int),
+    )
+
+
+# Token prices, the JSON log sink and the /metrics endpoint. Call once per process.
+#   AI_TOKEN_PRICES  {"gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached": 0.075}} (USD per 1M tokens)
+#   AI_METRICS_LOG   file that gets one JSON line per analysis ("-" for stderr)
+#   AI_METRICS_PORT  serve /metrics (Prometheus text) and /metrics.json on this port
+def configure_metrics(get_secret, registry=metrics):
+    prices = get_secret("AI_TOKEN_PRICES")
+    if prices:
+        registry.prices = json.loads(prices) if isinstance(prices, str) else {k: dict(v) for k, v in dict(prices).items()}
+    log_path = get_secret("AI_METRICS_LOG")
+    if log_path:
+        registry.add_sink(JsonLogSink(log_path))
+    port = get_secret("AI_METRICS_PORT")
+    if not port:
+        return None
+    try:
+        return start_metrics_server(int(port), setting(get_secret, "AI_METRICS_HOST", "127.0.0.1"), registry)
+    except OSError as e:
+        print(f"metrics endpoint not started on port {port}: {e}", file=sys.stderr)
+        return None
+
+
+def history_backend(get_secret):
+    return setting(get_secret, "HISTORY_BACKEND", "local").lower()
+
+
+def history_db_path(get_secret):
+    return setting(get_secret, "HISTORY_DB_PATH", DEFAULT_DB_PATH)
+
+
+# Deleted entries of the sqlite history are purged after this many days (0 keeps them)
+def history_trash_days(get_secret):
+    return setting(get_secret, "HISTORY_TRASH_DAYS", DEFAULT_TRASH_DAYS, float)
+
+
+def history_page_size(get_secret):
+    return setting(get_secret, "HISTORY_PAGE_SIZE", DEFAULT_PAGE_SIZE, int)
+
+
+# Task toggles are written this many seconds after the last click (0 writes every click)
+def history_write_delay(get_secret):
+    return setting(get_secret, "HISTORY_WRITE_DELAY", DEFAULT_WRITE_DELAY, float)
+
+
+def kb_top_k(get_secret):
+    return setting(get_secret, "AI_KB_TOP_K", DEFAULT_TOP_K, int)
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+import time
+
+from ophub.retry import FATAL, classify_error
+
+# Defaults (overridable with AI_CONTEXT_CACHE_TTL, AI_CONTEXT_CACHE_MIN_CHARS, AI_KEEP_ALIVE)
+DEFAULT_TTL = 3600  # seconds a Gemini cached guide lives
+DEFAULT_MIN_CHARS = 4000  # ~1k tokens; Gemini refuses to cache anything smaller
+RENEW_MARGIN = 60  # recreate a cache this many seconds before it expires
+
+
+def guide_fingerprint(kb):
+    return hashlib.sha256((kb or "").encode("utf-8")).hexdigest()[:16]
+
+
+# The guide always goes first so every request with the same guide shares one prefix
+def guide_prefix(kb):
+    return f"Guide:\n{kb}\n\n"
+
+
+def notes_suffix(notes):
+    return f"Notes:\n{notes}"
+
+
+class ContextCache:
+    # Gemini cached contents holding (system prompt + guide), one per model and guide version.
+    # When guide.txt changes the fingerprint changes, and the old cache is deleted.
+
+    def __init__(self, ttl=DEFAULT_TTL, min_chars=DEFAULT_MIN_CHARS):
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self._lock = threading.Lock()
+        self._caches = {}  # (base_url, model) -> {"fingerprint", "name", "expires"}
+        self._unsupported = set()  # (base_url, model, fingerprint) the API refused to cache
+        self._creating = set()  # slots with a create call in flight
+        self.created = 0
+        self.hits = 0
+        self.invalidated = 0
+
+    def _slot(self, target):
+        return (target.settings.base_url, target.model)
+
+    # Returns the cached content name to use, or None to send the guide inline.
+    # The create/delete calls run outside the lock: while one analysis makes the cache for a
+    # slot, the others send the guide inline instead of waiting for it.
+    def get(self, client, target, kb, system_instruction):
+        if target.provider != "gemini" or len(kb or "") < self.min_chars:
+            return None
+        fingerprint = guide_fingerprint(kb)
+        slot = self._slot(target)
+        with self._lock:
+            if slot + (fingerprint,) in self._unsupported or slot in self._creating:
+                return None
+            known = self._caches.get(slot)
+            if known and known["fingerprint"] == fingerprint and known["expires"] - RENEW_MARGIN > time.time():
+                self.hits += 1
+                return known["name"]
+            # guide changed (or cache expired): drop the old one, make a new one
+            stale = known["name"] if known else None
+            if stale:
+                self._caches.pop(slot, None)
+                self.invalidated += 1
+            self._creating.add(slot)
+
+        try:
+            if stale:
+                self._delete(client, stale)
+            name = self._create(client, target.model, kb, system_instruction, fingerprint)
+        except Exception as e:
+            with self._lock:
+                self._creating.discard(slot)
+                if classify_error(e) == FATAL:
+                    # e.g. guide below the model's minimum token count; don't ask again for this version
+                    self._unsupported.add(slot + (fingerprint,))
+            return None  # timeouts / 429s: inline this time, try again on the next analysis
+        with self._lock:
+            self._creating.discard(slot)
+            self._caches[slot] = {"fingerprint": fingerprint, "name": name, "expires": time.time() + self.ttl}
+            self.created += 1
+        return name
+
+    def _create(self, client, model, kb, system_instruction, fingerprint):
+        from google.genai import types
+
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"ophub-guide-{fingerprint}",
+                system_instruction=system_instruction,
+                contents=[guide_prefix(kb)],
+                ttl=f"{int(self.ttl)}s",
+            ),
+        )
+        return cache.name
+
+    def _delete(self, client, name):
+        try:
+            client.caches.delete(name=name)
+        except Exception:
+            pass  # it expires on its own anyway
+
+    # A call using the cache failed (expired early / deleted elsewhere): forget it
+    def forget(self, target):
+        with self._lock:
+            if self._caches.pop(self._slot(target), None) is not None:
+                self.invalidated += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._caches),
+                "created": self.created,
+                "hits": self.hits,
+                "invalidated": self.invalidated,
+                "unsupported": len(self._unsupported),
+            }
@@ -0,0 +1,390 @@
+import json
+import threading
+from contextlib import nullcontext
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ophub.cache import make_cache_key
+from ophub.context_cache import guide_prefix, notes_suffix
+from ophub.metrics import AnalysisTrace, metrics
+from ophub.providers import Prompt, complete, stream
+from ophub.retry import (AttemptStats, RetryPolicy, classify_error, repair_json, totals,
+                         EMPTY, FAIL_FAST, PARSE, TRANSIENT)
+from ophub.rules import RULES_PROVIDER
+from ophub.streaming import IncrementalJSONParser, REASONING, TASK
+
+# System prompt (Identical for both). Keep it byte-stable: it is the start of the cached prefix.
+SYSTEM_INSTRUCTION = (
+    "You are a Senior Operational Excellence Consultant. "
+    "STRICT REQUIREMENT: You must provide your output as a SINGLE VALID JSON OBJECT. "
+    "The JSON must have exactly two keys: "
+    "1. 'reasoning': A string explaining your thought process. "
+    "2. 'tasks': A list of strings for the actionable steps. "
+    "Do not include markdown formatting (like ```json). Just the raw JSON object."
+)
+
+# Failover / hedging defaults (AI_FAILOVER_ATTEMPTS, AI_HEDGE, AI_HEDGE_DELAY)
+DEFAULT_FAILOVER_ATTEMPTS = 2  # attempts on a backend before moving to the next one
+DEFAULT_HEDGE_DELAY = 15.0  # seconds, used until a provider has latency samples
+
+# Text pieces read after the JSON object closed, waiting for the usage chunk, before giving up
+MAX_TRAILING_PIECES = 4
+
+
+class AnalysisFailed(Exception):
+    pass
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+def default_temperature(provider):
+    return 0.2 if provider == "gemini" else 0.7
+
+
+# Guide first, notes last: everything before the notes is identical between calls
+def build_user_message(kb, notes):
+    return guide_prefix(kb) + notes_suffix(notes)
+
+
+class AnalysisRequest:
+    # Everything one analysis needs, shared by the failover / hedging branches
+
+    def __init__(self, kb, notes, client_registry, policy, streaming=True, latency=None,
+                 context_cache=None, keep_alive=None, trace=None, hold=None):
+        self.kb = kb
+        self.notes = notes
+        self.client_registry = client_registry
+        self.policy = policy
+        self.streaming = streaming
+        self.latency = latency
+        self.context_cache = context_cache
+        self.keep_alive = keep_alive
+        self.trace = trace or AnalysisTrace()
+        self.hold = hold  # hold(backend name, cancel_event) -> context manager for its concurrency slot
+
+    # Gemini: reuse the server-side cached guide when there is one.
+    # Ollama/OpenAI: stable prefix (automatic prefix caching) + keep_alive so the model stays loaded.
+    def slot(self, target, cancel_event):
+        return self.hold(target.name, cancel_event) if self.hold is not None else nullcontext()
+
+    def prompt(self, client, target):
+        if target.provider == "gemini" and self.context_cache is not None:
+            cached_content = self.context_cache.get(client, target, self.kb, SYSTEM_INSTRUCTION)
+            if cached_content:
+                return Prompt(None, notes_suffix(self.notes), cached_content=cached_content)
+        extra_body = None
+        if target.provider == "openai" and self.keep_alive:
+            extra_body = {"keep_alive": self.keep_alive}
+        return Prompt(SYSTEM_INSTRUCTION, build_user_message(self.kb, self.notes), extra_body=extra_body)
+
+
+def _emit(on_event, kind, value=None):
+    if on_event is not None:
+        on_event(kind, value)
+
+
+def _check_cancel(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise AnalysisCancelled("Analysis cancelled")
+
+
+# Blocking answers that are already valid JSON don't need (or count as) a repair
+def _parse_complete(text):
+    try:
+        data = json.loads(text or "")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _call(client, target, prompt, temperature, request, on_event, cancel_event):
+    settings = target.settings
+    trace = request.trace
+    usage = {}
+    if not request.streaming:
+        with trace.span("request", target):
+            text = complete(client, settings.provider, target.model, prompt, temperature, settings.timeout, usage)
+        trace.add_usage(target, usage)
+        with trace.span("parse", target):
+            return text, _parse_complete(text)
+
+    parser = IncrementalJSONParser()
+    pieces = []
+    sent, first, trailing = time.monotonic(), None, 0
+    chunks = stream(client, settings.provider, target.model, prompt, temperature, settings.timeout, usage)
+    try:
+        for piece in chunks:
+            _check_cancel(cancel_event)
+            if first is None:
+                first = time.monotonic()
+                trace.add("first_token", first - sent, target)
+            if parser.done:
+                # object already closed: only waiting for the usage at the end of the stream
+                trailing += 1
+                if trailing > MAX_TRAILING_PIECES:
+                    break
+                continue
+            pieces.append(piece)
+            for kind, value in parser.feed(piece):
+                if kind in (REASONING, TASK):
+                    _emit(on_event, kind, value)
+            if parser.done:
+                trace.add("generation", time.monotonic() - first, target)
+    finally:
+        chunks.close()
+        if first is not None and not parser.done:
+            trace.add("generation", time.monotonic() - first, target)
+        trace.add_usage(target, usage)
+    return "".join(pieces), parser.result
+
+
+def _wait(seconds, cancel_event):
+    if seconds <= 0:
+        return
+    if cancel_event is None:
+        time.sleep(seconds)
+    elif cancel_event.wait(seconds):
+        raise AnalysisCancelled("Analysis cancelled")
+
+
+class LinkedCancel:
+    # Cancel flag for one hedged branch: set by the winner, or by the job's own cancel
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._event = threading.Event()
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or (self.parent is not None and self.parent.is_set())
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._event.wait(min(remaining, 0.2))
+        return self.is_set()
+
+
+# The retry loop for one backend. Returns the result dict or raises AnalysisFailed.
+def _run_target(target, request, max_attempts, on_event, cancel_event, stats):
+    temperature = default_temperature(target.provider)
+    policy, latency, trace = request.policy, request.latency, request.trace
+    for attempt in range(1, max_attempts + 1):
+        _check_cancel(cancel_event)
+        _emit(on_event, "attempt", attempt)
+        stats.attempts += 1
+        stats.model_calls += 1
+        kind, error, prompt, client = None, None, None, None
+        started = time.monotonic()
+        try:
+            with trace.span("client", target):
+                client = request.client_registry.acquire(target.settings)
+            with trace.span("prompt", target):
+                prompt = request.prompt(client, target)
+            full_response, data = _call(client, target, prompt, temperature, request, on_event, cancel_event)
+            request.client_registry.report_success(target.settings)
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            kind, error = classify_error(e), e
+            request.client_registry.report_failure(target.settings, e)
+            if latency is not None:
+                latency.record_failure(target.name)
+            _emit(on_event, "error", f"Error ({target.name}, {kind}): {e}")
+            if prompt is not None and prompt.cached_content:
+                # cached guide expired or was deleted: send it inline next time
+                request.context_cache.forget(target)
+                kind = TRANSIENT
+            elif kind in FAIL_FAST:
+                stats.record_error(kind)
+                trace.attempt(target, kind)
+                raise AnalysisFailed(f"{target.name} rejected the request ({kind}): {e}") from e
+        finally:
+            if client is not None:
+                request.client_registry.release(client)
+        if kind is None:
+            if not full_response:
+                kind = EMPTY
+                _emit(on_event, "warning", f"Attempt {attempt}: Empty response. Retrying...")
+            else:
+                if not isinstance(data, dict):
+                    # try a local repair before paying for another model call
+                    with trace.span("parse", target):
+                        data = repair_json(full_response)
+                    if data is not None:
+                        stats.repairs += 1
+                if isinstance(data, dict):
+                    if latency is not None:
+                        latency.record(target.name, time.monotonic() - started)
+                    trace.attempt(target, "ok")
+                    return {
+                        "reasoning": data.get("reasoning", "No reasoning provided."),
+                        "tasks": list(data.get("tasks", [])),
+                    }
+                kind = PARSE
+                _emit(on_event, "warning", f"Attempt {attempt}: AI did not return valid JSON. Retrying...")
+
+        stats.record_error(kind)
+        trace.attempt(target, kind)
+        if attempt < max_attempts:
+            delay = policy.delay(attempt, TRANSIENT if kind == EMPTY else kind, error)
+            stats.backoff_seconds += delay
+            _emit(on_event, "retry", {"kind": kind, "delay": delay})
+            with trace.span("backoff", target):
+                _wait(delay, cancel_event)
+
+    raise AnalysisFailed(f"{target.name}: no valid response after {max_attempts} attempts")
+
+
+# Try each backend in order; earlier ones get fewer attempts so a dead backend is skipped quickly
+def _failover(targets, request, failover_attempts, on_event, cancel_event, stats):
+    errors = []
+    for position, target in enumerate(targets):
+        is_last = position == len(targets) - 1
+        max_attempts = request.policy.max_attempts
+        if not is_last:
+            max_attempts = min(max_attempts, failover_attempts)
+        try:
+            with request.slot(target, cancel_event):  # backups count against their own cap too
+                return _run_target(target, request, max_attempts, on_event, cancel_event, stats), target
+        except AnalysisFailed as e:
+            errors.append(str(e))
+            if not is_last:
+                _emit(on_event, "failover", targets[position + 1].name)
+    raise AnalysisFailed("; ".join(errors))
+
+
+# Preview events from the backup branch would fight with the primary's preview
+def _quiet(on_event):
+    def forward(kind, value=None):
+        if kind not in ("attempt", "reasoning", "task"):
+            _emit(on_event, kind, value)
+    return forward
+
+
+# Start the primary; if it has not answered by its p95 latency, also start the backups.
+# First valid answer wins and the other branch is cancelled.
+def _hedged(targets, request, failover_attempts, on_event, cancel_event, stats, hedge_delay):
+    primary, backups = targets[0], targets[1:]
+    delay = request.latency.percentile(primary.name, 95) if request.latency is not None else None
+    delay = hedge_delay if delay is None else delay
+    branches = {}  # future -> (cancel flag, stats)
+
+    def launch(executor, branch_targets, branch_on_event):
+        flag, branch_stats = LinkedCancel(cancel_event), AttemptStats()
+        future = executor.submit(_failover, branch_targets, request, failover_attempts,
+                                 branch_on_event, flag, branch_stats)
+        branches[future] = (flag, branch_stats)
+        return future
+
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        launch(executor, [primary], on_event)
+        done, pending = wait(list(branches), timeout=delay, return_when=FIRST_COMPLETED)
+        if not done or next(iter(done)).exception() is not None:
+            _emit(on_event, "hedge", backups[0].name)
+            launch(executor, backups, _quiet(on_event))
+
+        errors = []
+        pending = set(branches)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except AnalysisCancelled:
+                    raise
+                except AnalysisFailed as e:
+                    errors.append(str(e))
+                    continue
+                for other in pending:
+                    branches[other][0].set()
+                return result
+        raise AnalysisFailed("; ".join(errors))
+    finally:
+        for flag, branch_stats in branches.values():
+            stats.merge(branch_stats)
+        executor.shutdown(wait=False)
+
+
+# Runs one analysis without touching any UI.
+# targets is the ordered list of ophub.providers.ProviderTarget to try.
+# hold (ophub.jobs.Job.hold) caps how many analyses use each backend at once.
+# Returns {"reasoning": str, "tasks": [str, ...], "provider": name}
+# or raises AnalysisFailed / AnalysisCancelled.
+# on_event(kind, value) receives: "status", "cache_hit", "attempt", "reasoning", "task",
+# "warning", "error", "retry" ({"kind", "delay"}), "failover" / "hedge" (next backend name),
+# "attempt_stats" (AttemptStats.to_dict()) and "trace" (stage timings / tokens, AnalysisTrace.to_dict()).
+def run_analysis(kb, notes, targets, client_registry, response_cache=None, streaming=True,
+                 on_event=None, cancel_event=None, retry_policy=None, latency=None, hedge=False,
+                 hedge_delay=DEFAULT_HEDGE_DELAY, failover_attempts=DEFAULT_FAILOVER_ATTEMPTS,
+                 context_cache=None, keep_alive=None, similar_notes=None, reuse_similar=False,
+                 rules=None, hold=None):
+    trace = AnalysisTrace()
+    request = AnalysisRequest(kb, notes, client_registry, retry_policy or RetryPolicy(), streaming,
+                              latency, context_cache, keep_alive, trace, hold)
+    stats = AttemptStats()
+    _emit(on_event, "status", "Analysis started")
+
+    def cache_key(target):
+        return make_cache_key(target.model, kb, notes, SYSTEM_INSTRUCTION, default_temperature(target.provider))
+
+    outcome, result, winner = "failed", None, None
+    try:
+        # Notes the guide rules fully cover are answered without a model (ophub.rules)
+        if rules is not None:
+            with trace.span("rules"):
+                answer = rules.resolve(notes)
+            if answer:
+                outcome = "rules_hit"
+                _emit(on_event, "rules_hit", len(answer["tasks"]))
+                return dict(answer, provider=RULES_PROVIDER)
+
+        if response_cache is not None:
+            with trace.span("cache_lookup"):
+                cached = next(filter(None, (response_cache.get(cache_key(target)) for target in targets)), None)
+            if cached:
+                outcome = "cache_hit"
+                _emit(on_event, "cache_hit", cached.get("provider"))
+                return cached
+
+        # Near-identical notes against the same guide: hand back the earlier answer, no model call
+        if similar_notes is not None and reuse_similar:
+            with trace.span("similar_lookup"):
+                match = similar_notes.best(kb, notes)
+            if match:
+                outcome = "similar_hit"
+                _emit(on_event, "similar_hit", match.score)
+                return dict(match.result, similarity=round(match.score, 4))
+
+        try:
+            if hedge and len(targets) > 1:
+                result, winner = _hedged(targets, request, failover_attempts, on_event, cancel_event,
+                                         stats, hedge_delay)
+            else:
+                result, winner = _failover(targets, request, failover_attempts, on_event, cancel_event, stats)
+        except AnalysisCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            totals.add(stats, failed=result is None)
+            _emit(on_event, "attempt_stats", stats.to_dict())
+        outcome = "done"
+    finally:
+        trace.finish(outcome, winner.name if winner else None)
+        metrics.record_analysis(trace)
+        _emit(on_event, "trace", trace.to_dict())
+
+    result["provider"] = winner.name
+    if response_cache is not None:
+        response_cache.set(cache_key(winner), result)
+    if similar_notes is not None:
+        similar_notes.add(kb, notes, result)
+    return result
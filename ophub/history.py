@@ -0,0 +1,824 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from itertools import islice
+from uuid import uuid4
+
+from ophub.search import HistoryIndex
+
+LEGACY_STORAGE_KEY = "user_history_v1"  # whole list under one key
+V2_STORAGE_PREFIX = "user_history_v2"  # one JSON dict per entry + an id index
+STORAGE_PREFIX = "user_history_v3"  # one compact (maybe compressed) string per entry
+COMPACT_VERSION = 4  # 4 added the position; version 3 records (ordered by an index key) still decode
+DEFAULT_DB_PATH = os.path.join(".cache", "history.sqlite3")
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_WRITE_DELAY = 2.0  # seconds of quiet before buffered task toggles are written
+DEFAULT_BUSY_TIMEOUT = 10.0  # seconds a sqlite writer waits for another process's write
+DEFAULT_TRASH_DAYS = 30  # deleted sqlite entries older than this are purged (0 keeps them)
+MAX_CONFLICT_RETRIES = 3
+
+_SUFFIX = re.compile(r"^(.*) \((\d+)\)$")  # "Client - Job (3)" -> ("Client - Job", 3)
+
+
+class HistoryConflict(Exception):
+    # The entry was changed (or deleted) elsewhere since this process last read it
+
+    def __init__(self, entry_id):
+        super().__init__(f"history entry {entry_id} was changed by someone else")
+        self.entry_id = entry_id
+
+
+def new_entry(project_name, reasoning, tasks):
+    return {
+        "id": uuid4().hex,
+        "project": project_name,
+        "reasoning": reasoning,
+        "tasks": tasks
+    }
+
+
+# Old exports (history_log.json) have no ids
+def _with_id(entry):
+    if not entry.get("id"):
+        entry = dict(entry, id=uuid4().hex)
+    return entry
+
+
+# Compact strings for LocalStorage: "j" + minified JSON, or "z" + base64(zlib(JSON))
+# when that is shorter (long reasoning compresses well, short entries don't)
+def _pack(data, level=6):
+    text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    packed = base64.b64encode(zlib.compress(text.encode("utf-8"), level)).decode("ascii")
+    return "z" + packed if len(packed) < len(text) else "j" + text
+
+
+def _unpack(value):
+    if value[:1] == "z":
+        return json.loads(zlib.decompress(base64.b64decode(value[1:])).decode("utf-8"))
+    return json.loads(value[1:])
+
+
+# [version, id, project, reasoning, task names, done bitset (hex), position, extra keys]
+# Task dicts with fields other than task/done are kept as they are in extra["tasks"].
+# position orders the entries (highest = newest), so no key has to list them all.
+def encode_entry(entry, position=None):
+    tasks = entry.get("tasks") or []
+    extra = {key: value for key, value in entry.items() if key not in ("id", "project", "reasoning", "tasks")}
+    if all(set(task) <= {"task", "done"} for task in tasks):
+        names = [task["task"] for task in tasks]
+        done = format(sum(1 << i for i, task in enumerate(tasks) if task.get("done")), "x")
+    else:
+        names, done = None, "0"
+        extra["tasks"] = tasks
+    record = [COMPACT_VERSION, entry["id"], entry["project"], entry.get("reasoning"), names, done, position]
+    if extra:
+        record.append(extra)
+    return _pack(record)
+
+
+# (entry, position); position is None for version 3 records
+def decode_record(value):
+    record = _unpack(value)
+    version, entry_id, project, reasoning, names, done = record[:6]
+    if version >= 4:
+        position, extra = record[6], record[7] if len(record) > 7 else {}
+    else:
+        position, extra = None, record[6] if len(record) > 6 else {}
+    entry = {"id": entry_id, "project": project, "reasoning": reasoning}
+    if names is not None:
+        bits = int(done, 16)
+        entry["tasks"] = [{"task": name, "done": bool(bits >> i & 1)} for i, name in enumerate(names)]
+    entry.update(extra)
+    return entry, position
+
+
+def decode_entry(value):
+    return decode_record(value)[0]
+
+
+# The id index of the first v3 layout (read once, to migrate): new_entry ids (uuid hex) as raw bytes,
+# "h" + base64, 22 characters per id instead of 35. Imported ids of any other shape fall back to _pack.
+def encode_ids(ids):
+    try:
+        joined = "".join(ids)
+        packed = bytes.fromhex(joined)
+    except (TypeError, ValueError):
+        return _pack(ids)
+    # .hex() round trip rules out upper case and whitespace, which fromhex accepts
+    if packed.hex() != joined or len(packed) != 16 * len(ids) or min(map(len, ids), default=32) != 32:
+        return _pack(ids)
+    return "h" + base64.b64encode(packed).decode("ascii")
+
+
+def decode_ids(value):
+    if value[:1] == "h":
+        packed = base64.b64decode(value[1:]).hex()
+        return [packed[i:i + 32] for i in range(0, len(packed), 32)]
+    return _unpack(value)
+
+
+class LocalStorageBackend:
+    # Browser LocalStorage through streamlit_local_storage.
+    # Each entry lives under its own key, so a change only re-sends that entry,
+    # stored compactly (encode_entry) to keep syncs small and under the browser quota.
+    # The order is a position inside each entry, so creating or deleting a project
+    # writes that one key too, never a list of every id.
+
+    def __init__(self, local_storage, prefix=STORAGE_PREFIX, legacy_key=LEGACY_STORAGE_KEY,
+                 v2_prefix=V2_STORAGE_PREFIX):
+        self.ls = local_storage
+        self.prefix = prefix
+        self.legacy_key = legacy_key
+        self.v2_prefix = v2_prefix
+        self._positions = {}  # id -> position
+        self._top = 0.0  # highest position handed out
+        self._writes = 0
+
+    def _key(self, entry_id):
+        return f"{self.prefix}:{entry_id}"
+
+    def _index_key(self):
+        return f"{self.prefix}:index"
+
+    # Every component call in one script run needs its own widget key
+    def _set(self, item_key, value):
+        self._writes += 1
+        self.ls.setItem(item_key, value, key=f"{self.prefix}_set_{self._writes}")
+
+    def _delete(self, item_key):
+        if self.ls.getItem(item_key) is None:  # deleteItem raises KeyError for a key it didn't read
+            return
+        self._writes += 1
+        self.ls.deleteItem(item_key, key=f"{self.prefix}_del_{self._writes}")
+
+    def _write(self, entry):
+        self._set(self._key(entry["id"]), encode_entry(entry, self._positions[entry["id"]]))
+
+    def load(self):
+        items = self.ls.getAll() or {}
+        index_key = self._index_key()
+        keys = [key for key in items if key.startswith(self.prefix + ":") and key != index_key]
+        if index_key in items:
+            return self._migrate_index(items[index_key], keys)
+        if not keys:
+            return self._migrate()
+        records = [decode_record(items[key]) for key in keys]
+        records.sort(key=lambda record: record[1] or 0.0, reverse=True)
+        self._positions = {entry["id"]: position or 0.0 for entry, position in records}
+        self._top = max(self._positions.values(), default=0.0)
+        return [entry for entry, _ in records]
+
+    # Newest first -> positions n..1, each entry written with its position
+    def _store_all(self, entries):
+        self._positions = {entry["id"]: float(len(entries) - i) for i, entry in enumerate(entries)}
+        self._top = float(len(entries))
+        for entry in entries:
+            self._write(entry)
+
+    # First v3 layout: the order was one index key, rewritten on every create/delete.
+    # Entries get their positions once and the index goes; ids it didn't list were never shown.
+    def _migrate_index(self, index, keys):
+        stored = set(keys)
+        entries = [decode_entry(self.ls.getItem(self._key(entry_id))) for entry_id in decode_ids(index)
+                   if self._key(entry_id) in stored]
+        self._store_all(entries)
+        for key in stored - {self._key(entry["id"]) for entry in entries}:
+            self._delete(key)
+        self._delete(self._index_key())
+        return entries
+
+    # One-off copy from the v2 per-entry dicts, or else the single-key v1 list.
+    # The old keys are removed afterwards to give the quota back.
+    def _migrate(self):
+        old_keys = []
+        v2_ids = self.ls.getItem(f"{self.v2_prefix}:index")
+        if v2_ids is not None:
+            entries = []
+            for entry_id in v2_ids:
+                entry = self.ls.getItem(f"{self.v2_prefix}:{entry_id}")
+                if entry is not None:  # v2 wrote entry and index in separate calls: ids can dangle
+                    entries.append(entry)
+                    old_keys.append(f"{self.v2_prefix}:{entry_id}")
+            old_keys.append(f"{self.v2_prefix}:index")
+        else:
+            entries = self.ls.getItem(self.legacy_key) or []
+        if self.ls.getItem(self.legacy_key) is not None:
+            old_keys.append(self.legacy_key)
+
+        entries = [_with_id(entry) for entry in entries]
+        self._store_all(entries)
+        for key in old_keys:
+            self._delete(key)
+        return entries
+
+    # above_id=None puts the entry at the top, otherwise right under above_id
+    def insert(self, entry, above_id=None):
+        self._positions.pop(entry["id"], None)
+        if above_id in self._positions:
+            # the entry right under above_id: a scan, but only restores insert anywhere but the top
+            above = self._positions[above_id]
+            below = max((position for position in self._positions.values() if position < above), default=None)
+            position = above - 1.0 if below is None else (above + below) / 2
+        else:
+            self._top += 1.0
+            position = self._top
+        self._positions[entry["id"]] = position
+        self._write(entry)
+
+    def update(self, entry):
+        if entry["id"] in self._positions:  # never write a deleted entry back
+            self._write(entry)
+
+    # One key per entry, so a batch is simply one write per entry
+    def update_many(self, entries):
+        for entry in entries:
+            self.update(entry)
+
+    def delete(self, entry_id):
+        if entry_id in self._positions:
+            del self._positions[entry_id]
+            self._delete(self._key(entry_id))
+
+
+class SqliteHistoryBackend:
+    # Server-side history file shared by every session and process (WAL: readers don't block
+    # the writer). Rows are ordered by a sortable position.
+    # Optimistic concurrency: each row has a version, and an update only goes through while the
+    # row is still at the version this process last read; otherwise HistoryConflict.
+    # Deletes are soft (deleted_at) and make up the trash until purge_trash(), or until they
+    # are trash_days old (checked when the file is opened and on every delete).
+    # Every write takes the next value of a change counter (seq), so changes() only reads
+    # the rows written since the previous call.
+
+    def __init__(self, path=DEFAULT_DB_PATH, timeout=DEFAULT_BUSY_TIMEOUT, trash_days=DEFAULT_TRASH_DAYS):
+        self.trash_days = trash_days
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._versions = {}  # id -> version this process last saw
+        self._seq = 0  # change counter this process has caught up to
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id TEXT PRIMARY KEY, position REAL NOT NULL,"
+            " project TEXT NOT NULL, reasoning TEXT, tasks TEXT NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 1, deleted_at REAL, seq INTEGER NOT NULL DEFAULT 0)"
+        )
+        # files from before versions/trash
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(history)")}
+        for name, spec in (("version", "INTEGER NOT NULL DEFAULT 1"), ("deleted_at", "REAL"),
+                           ("seq", "INTEGER NOT NULL DEFAULT 0")):
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE history ADD COLUMN {name} {spec}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_position ON history (position)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_live ON history (deleted_at, position)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_seq ON history (seq)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS history_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO history_meta (key, value) VALUES ('seq', 0)")
+        self._db.commit()
+        self._purge_expired()
+
+    def _current_seq(self, key="seq"):
+        row = self._db.execute("SELECT value FROM history_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    # Inside a write transaction, so concurrent writers get distinct numbers
+    def _next_seq(self):
+        self._db.execute("UPDATE history_meta SET value = value + 1 WHERE key = 'seq'")
+        return self._current_seq()
+
+    def _entry(self, row):
+        self._versions[row[0]] = row[4]
+        return {"id": row[0], "project": row[1], "reasoning": row[2], "tasks": json.loads(row[3])}
+
+    def load(self):
+        with self._lock:
+            self._seq = self._current_seq()  # read first: a write in between just comes back in changes()
+            rows = self._db.execute(
+                "SELECT id, project, reasoning, tasks, version FROM history"
+                " WHERE deleted_at IS NULL ORDER BY position DESC"
+            ).fetchall()
+            self._versions = {}
+            return [self._entry(row) for row in rows]
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, project, reasoning, tasks, version FROM history WHERE id = ? AND deleted_at IS NULL",
+                (entry_id,),
+            ).fetchone()
+            return self._entry(row) if row else None
+
+    # [(entry, deleted)] for the rows written since the last load()/changes(), by any process
+    def changes(self):
+        with self._lock:
+            current = self._current_seq()
+            if current == self._seq:
+                return []
+            rows = self._db.execute(
+                "SELECT id, project, reasoning, tasks, version, deleted_at FROM history"
+                " WHERE seq > ? AND seq <= ? ORDER BY seq",
+                (self._seq, current),
+            ).fetchall()
+            changed = []
+            for row in rows:
+                if row[5] is None:
+                    changed.append((self._entry(row), False))
+                else:
+                    self._versions.pop(row[0], None)
+                    changed.append(({"id": row[0]}, True))
+            # purged rows are gone, so anything known here but no longer live was deleted
+            if self._current_seq("purged") > self._seq:
+                live = {row[0] for row in self._db.execute("SELECT id FROM history WHERE deleted_at IS NULL")}
+                for entry_id in [entry_id for entry_id in self._versions if entry_id not in live]:
+                    self._versions.pop(entry_id)
+                    changed.append(({"id": entry_id}, True))
+            self._seq = current
+            return changed
+
+    # Live ids, newest first (only the ids, for re-sorting after changes())
+    def order(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM history WHERE deleted_at IS NULL ORDER BY position DESC"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _position(self, entry_id):
+        row = self._db.execute("SELECT position FROM history WHERE id = ?", (entry_id,)).fetchone()
+        return row[0] if row else None
+
+    # Newest first = highest position first.
+    # above_id=None puts the entry at the top, otherwise right under above_id.
+    # Also brings back a soft-deleted row (restore).
+    def insert(self, entry, above_id=None):
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN IMMEDIATE")  # positions are read and written under the write lock
+                above = self._position(above_id) if above_id is not None else None
+                if above is None:
+                    top = self._db.execute("SELECT MAX(position) FROM history").fetchone()[0]
+                    position = (top or 0.0) + 1.0
+                else:
+                    below = self._db.execute(
+                        "SELECT MAX(position) FROM history WHERE position < ?", (above,)
+                    ).fetchone()[0]
+                    position = above - 1.0 if below is None else (above + below) / 2
+                previous = self._db.execute("SELECT version FROM history WHERE id = ?", (entry["id"],)).fetchone()
+                version = previous[0] + 1 if previous else 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO history (id, position, project, reasoning, tasks, version, deleted_at, seq)"
+                    " VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                    (entry["id"], position, entry["project"], entry.get("reasoning"), json.dumps(entry["tasks"]),
+                     version, self._next_seq()),
+                )
+            self._versions[entry["id"]] = version
+
+    def update(self, entry):
+        self.update_many([entry])
+
+    # One transaction: either every entry is written or none is (HistoryConflict)
+    def update_many(self, entries):
+        with self._lock:
+            versions = {}
+            with self._db:
+                seq = self._next_seq()
+                for entry in entries:
+                    expected = self._versions.get(entry["id"])
+                    cursor = self._db.execute(
+                        "UPDATE history SET project = ?, reasoning = ?, tasks = ?, version = version + 1, seq = ?"
+                        " WHERE id = ? AND version = ? AND deleted_at IS NULL",
+                        (entry["project"], entry.get("reasoning"), json.dumps(entry["tasks"]), seq,
+                         entry["id"], expected),
+                    )
+                    if cursor.rowcount != 1:
+                        raise HistoryConflict(entry["id"])
+                    versions[entry["id"]] = expected + 1
+            self._versions.update(versions)
+
+    # Soft delete: the row stays as a trash item
+    def delete(self, entry_id):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    "UPDATE history SET deleted_at = ?, version = version + 1, seq = ?"
+                    " WHERE id = ? AND deleted_at IS NULL",
+                    (time.time(), self._next_seq(), entry_id),
+                )
+            self._versions.pop(entry_id, None)
+        self._purge_expired()
+
+    def has_trash(self):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM history WHERE deleted_at IS NOT NULL LIMIT 1").fetchone() is not None
+
+    # Deleted entries, oldest delete first: only id and project, see trashed() for the rest
+    def trash(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, project FROM history WHERE deleted_at IS NOT NULL ORDER BY deleted_at"
+            ).fetchall()
+            return [{"id": row[0], "project": row[1]} for row in rows]
+
+    # One deleted entry with the 'original_index' restore() expects, counted now (entries
+    # added or deleted since the delete move it), or None if it is no longer in the trash
+    def trashed(self, entry_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, project, reasoning, tasks, position FROM history WHERE id = ? AND deleted_at IS NOT NULL",
+                (entry_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            above = self._db.execute(
+                "SELECT COUNT(*) FROM history WHERE deleted_at IS NULL AND position > ?", (row[4],)
+            ).fetchone()[0]
+            return {"id": row[0], "project": row[1], "reasoning": row[2], "tasks": json.loads(row[3]),
+                    "original_index": above}
+
+    # Everything in the trash, or only the entries deleted before older_than (a timestamp)
+    def purge_trash(self, older_than=None):
+        with self._lock:
+            with self._db:
+                if older_than is None:
+                    cursor = self._db.execute("DELETE FROM history WHERE deleted_at IS NOT NULL")
+                else:
+                    cursor = self._db.execute("DELETE FROM history WHERE deleted_at < ?", (older_than,))
+                if cursor.rowcount:
+                    self._db.execute("INSERT OR REPLACE INTO history_meta (key, value) VALUES ('purged', ?)",
+                                     (self._next_seq(),))
+
+    def _purge_expired(self):
+        if self.trash_days > 0:
+            self.purge_trash(older_than=time.time() - self.trash_days * 86400)
+
+
+def _set_tasks(entry, done_by_index):
+    tasks = entry.get("tasks") or []
+    for task_index, done in done_by_index.items():
+        if task_index < len(tasks):
+            tasks[task_index]["done"] = done
+
+
+class HistoryStore:
+    # Ordered history with an id -> entry index.
+    # Mutations touch one entry and send one patch to the backend.
+    # With write_delay > 0 task toggles are write-behind: the entry changes right away, the
+    # backend write waits until flush() (write_delay seconds after the last toggle, or forced),
+    # so ticking off several tasks of a project ends up as one write of that project.
+    # Toggles not flushed yet only live in memory: a closed tab loses up to write_delay seconds
+    # of them (the LocalStorage UI accepts that window; write_delay=0 writes every toggle).
+    # Optional backend parts (SqliteHistoryBackend): get/changes/order for other processes'
+    # writes (sync, HistoryConflict) and trash/purge_trash for a persistent trash; without them
+    # the trash lives in this store.
+
+    def __init__(self, backend, write_delay=0):
+        self.backend = backend
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._entries = {}  # id -> entry, oldest first (newest is last)
+        self._dirty = {}  # id -> {task index: done} not written yet
+        self._last_change = 0.0
+        self._trash = []  # deleted entries (when the backend has no trash)
+        # id -> position (higher = newer), so a delete only notes where the entry was and
+        # restore() counts its index then; kept for the entries in self._trash too
+        self._positions = {}
+        self._top = 0.0
+        self._search = None  # HistoryIndex, built by the first search() and then kept up to date
+        # Name index for unique_name: how many entries use each exact name, and for each
+        # base name the "(n)" suffixes in use plus the highest one
+        self._name_counts = {}
+        self._suffixes = {}  # base -> {n: count}
+        self._highest = {}  # base -> highest n in use
+        for entry in reversed(backend.load()):
+            self._entries[entry["id"]] = entry
+            self._index_name(entry["project"])
+        self._renumber()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._entries
+
+    def get(self, entry_id):
+        return self._entries.get(entry_id)
+
+    # Newest first, like the old list
+    def all(self):
+        with self._lock:
+            return list(reversed(self._entries.values()))
+
+    def page(self, page, page_size=DEFAULT_PAGE_SIZE):
+        with self._lock:
+            start = page * page_size
+            return list(islice(reversed(self._entries.values()), start, start + page_size))
+
+    def page_count(self, page_size=DEFAULT_PAGE_SIZE):
+        return max(1, -(-len(self._entries) // page_size))
+
+    def names(self):
+        with self._lock:
+            return [entry["project"] for entry in self._entries.values()]
+
+    def _index_name(self, name):
+        self._name_counts[name] = self._name_counts.get(name, 0) + 1
+        match = _SUFFIX.match(name)
+        if match:
+            base, n = match.group(1), int(match.group(2))
+            used = self._suffixes.setdefault(base, {})
+            used[n] = used.get(n, 0) + 1
+            if n > self._highest.get(base, 0):
+                self._highest[base] = n
+
+    def _unindex_name(self, name):
+        count = self._name_counts.get(name, 0) - 1
+        if count > 0:
+            self._name_counts[name] = count
+        else:
+            self._name_counts.pop(name, None)
+        match = _SUFFIX.match(name)
+        if not match:
+            return
+        base, n = match.group(1), int(match.group(2))
+        used = self._suffixes.get(base, {})
+        if used.get(n, 0) > 1:
+            used[n] -= 1
+            return
+        used.pop(n, None)
+        if not used:
+            self._suffixes.pop(base, None)
+            self._highest.pop(base, None)
+        elif self._highest.get(base) == n:
+            self._highest[base] = max(used)  # only when the top suffix goes away
+
+    # Checks if a name exists and adds (1), (2), etc. if needed.
+    # The next suffix is one past the highest in use, so gaps left by deletes are not refilled.
+    def unique_name(self, target_name):
+        with self._lock:
+            if target_name not in self._name_counts:
+                return target_name
+            return f"{target_name} ({self._highest.get(target_name, 0) + 1})"
+
+    def add(self, entry):
+        with self._lock:
+            entry = _with_id(entry)
+            self._entries[entry["id"]] = entry
+            self._index_name(entry["project"])
+            self._top += 1.0
+            self._positions[entry["id"]] = self._top
+            self.backend.insert(entry)
+            self._reindex(entry)
+            return entry
+
+    def _renumber(self):
+        self._positions = {entry_id: float(i) for i, entry_id in enumerate(self._entries, 1)}
+        self._top = float(len(self._entries))
+
+    def _reindex(self, entry):
+        if self._search is not None:
+            self._search.add(entry)
+
+    # Takes the newer copy of an entry in place (the UI holds on to the dict),
+    # keeping toggles that are not written yet
+    def _replace(self, entry, fresh):
+        self._unindex_name(entry["project"])
+        for key in [key for key in entry if key not in fresh]:
+            del entry[key]
+        entry.update(fresh)
+        self._index_name(entry["project"])
+        _set_tasks(entry, self._dirty.get(entry["id"], {}))
+        self._reindex(entry)
+
+    def _drop(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._unindex_name(entry["project"])
+        self._positions.pop(entry_id, None)
+        self._dirty.pop(entry_id, None)
+        if self._search is not None:
+            self._search.remove(entry_id)
+
+    # Writes an edited entry. If another process changed it meanwhile, the entry is read again,
+    # change(entry) re-applied on top and the write retried; None if it was deleted there.
+    def _save(self, entry, change):
+        for _ in range(MAX_CONFLICT_RETRIES):
+            try:
+                self.backend.update(entry)
+                return entry
+            except HistoryConflict:
+                fresh = self.backend.get(entry["id"])
+                if fresh is None:
+                    self._drop(entry["id"])
+                    return None
+                self._replace(entry, fresh)
+                change(entry)
+        raise HistoryConflict(entry["id"])
+
+    def update_task(self, entry_id, task_index, done):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return None
+            change = lambda entry: _set_tasks(entry, {task_index: done})
+            change(entry)
+            if self._search is not None:
+                self._search.update_tasks(entry)
+            if self.write_delay > 0:
+                self._dirty.setdefault(entry_id, {})[task_index] = done
+                self._last_change = time.monotonic()
+                return entry
+            return self._save(entry, change)
+
+    def pending(self):
+        return len(self._dirty)
+
+    # Writes every buffered entry in one backend call. Ids are only cleared once the write went
+    # through, so a failed flush is simply retried by the next one.
+    # due_only=True skips the write until write_delay has passed since the last toggle.
+    def flush(self, due_only=False):
+        with self._lock:
+            if not self._dirty:
+                return 0
+            if due_only and time.monotonic() - self._last_change < self.write_delay:
+                return 0
+            ids = [entry_id for entry_id in self._dirty if entry_id in self._entries]
+            try:
+                self.backend.update_many([self._entries[entry_id] for entry_id in ids])
+            except HistoryConflict:
+                # changed elsewhere: one by one, re-applying this session's toggles where needed
+                for entry_id in ids:
+                    toggles = self._dirty[entry_id]
+                    self._save(self._entries[entry_id], lambda entry: _set_tasks(entry, toggles))
+                    self._dirty.pop(entry_id, None)
+            self._dirty.clear()
+            return len(ids)
+
+    # Takes in what other processes wrote since the last call (backends with changes())
+    def sync(self):
+        changes = getattr(self.backend, "changes", None)
+        if changes is None:
+            return 0
+        with self._lock:
+            rows = changes()
+            added = False
+            for entry, deleted in rows:
+                current = self._entries.get(entry["id"])
+                if deleted:
+                    self._drop(entry["id"])
+                elif current is None:
+                    self._entries[entry["id"]] = entry
+                    self._index_name(entry["project"])
+                    self._reindex(entry)
+                    added = True
+                elif current != entry:
+                    self._replace(current, entry)
+            if added:  # new rows can sit anywhere (restores), so take the backend's order
+                self._entries = {entry_id: self._entries[entry_id]
+                                 for entry_id in reversed(self.backend.order()) if entry_id in self._entries}
+                self._renumber()
+            return len(rows)
+
+    def rename(self, entry_id, new_name):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return None
+            final_name = self.unique_name(new_name)
+
+            def change(entry):
+                self._unindex_name(entry["project"])
+                self._index_name(final_name)
+                entry["project"] = final_name
+                self._reindex(entry)
+
+            change(entry)
+            if self._save(entry, change) is None:
+                return None
+            self._dirty.pop(entry_id, None)  # the whole entry, toggles included, was just written
+            return final_name
+
+    # Returns a copy of the removed entry (restore() takes it, or an item of trash()).
+    # Only its position is kept: the index it goes back to is counted by restore().
+    def delete(self, entry_id):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return None
+            position = self._positions.get(entry_id)
+            self.backend.delete(entry_id)
+            self._drop(entry_id)
+            deleted = dict(entry)
+            if not hasattr(self.backend, "trash"):
+                self._trash.append(deleted)
+                self._positions[entry_id] = position
+            return deleted
+
+    # Put a deleted entry back at (or near) its old spot. entry is what delete() returned or
+    # an item of trash(); None if it is no longer in the trash (purged by another session).
+    def restore(self, entry):
+        with self._lock:
+            if entry["id"] in self._entries:  # already restored (shared trash)
+                return self._entries[entry["id"]]
+            if "tasks" not in entry:
+                entry = self._trashed(entry["id"])
+                if entry is None:
+                    return None
+            entry = dict(entry)
+            index = entry.pop("original_index", 0)  # a backend trash counts it (trashed())
+            position = self._positions.get(entry["id"])
+            if position is None:
+                position = self._position_at(min(index, len(self._entries)))
+            self._positions[entry["id"]] = position
+            # one pass, oldest first: it goes right before the first newer entry, which is
+            # the one above it (O(N), but restore is rare compared to the other mutations)
+            above_id = None
+            previous = self._entries
+            self._entries = {}
+            for entry_id, other in previous.items():
+                if above_id is None and self._positions[entry_id] > position:
+                    above_id = entry_id
+                    self._entries[entry["id"]] = entry
+                self._entries[entry_id] = other
+            if above_id is None:
+                self._entries[entry["id"]] = entry
+            self._index_name(entry["project"])
+            self.backend.insert(entry, above_id=above_id)
+            self._reindex(entry)
+            self._trash = [item for item in self._trash if item["id"] != entry["id"]]
+            return entry
+
+    # A position for a newest-first index, between the entries around it
+    def _position_at(self, index):
+        around = [self._positions[entry_id] for entry_id in islice(reversed(self._entries), max(index - 1, 0), index + 1)]
+        if index == 0:
+            self._top += 1.0
+            return self._top
+        above = around[0]
+        return above - 1.0 if len(around) < 2 else (above + around[1]) / 2
+
+    def _trashed(self, entry_id):
+        if hasattr(self.backend, "trash"):
+            return self.backend.trashed(entry_id)
+        return next((item for item in self._trash if item["id"] == entry_id), None)
+
+    def has_trash(self):
+        if hasattr(self.backend, "trash"):
+            return self.backend.has_trash()
+        with self._lock:
+            return bool(self._trash)
+
+    # Deleted entries, oldest delete first, as {"id", "project"} (restore() takes these)
+    def trash(self):
+        if hasattr(self.backend, "trash"):
+            return self.backend.trash()
+        with self._lock:
+            return [{"id": item["id"], "project": item["project"]} for item in self._trash]
+
+    def clear_trash(self):
+        if hasattr(self.backend, "trash"):
+            self.backend.purge_trash()
+        with self._lock:
+            for item in self._trash:
+                self._positions.pop(item["id"], None)
+            self._trash = []
+
+    # Entries whose name, reasoning or tasks match every word of query (as prefixes), best match
+    # first, then newest; status="open"/"completed" (ophub.search.OPEN/COMPLETED) filters
+    def search(self, query, status=None, limit=None):
+        with self._lock:
+            if self._search is None:
+                self._search = HistoryIndex(self._entries.values())
+            return [self._entries[entry_id] for entry_id in self._search.search(query, status, limit)]
+
+    # history_log.json style import/export
+    def import_entries(self, entries):
+        added = []
+        with self._lock:
+            for entry in reversed(list(entries)):  # files are newest first
+                entry = _with_id(entry)
+                if entry["id"] in self._entries:
+                    continue
+                added.append(self.add(entry))
+        return added
+
+    def export_entries(self):
+        return [{key: value for key, value in entry.items() if key != "original_index"} for entry in self.all()]
+
+
+def read_history_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_history_file(path, entries):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from ophub.engine import AnalysisCancelled
+
+# Defaults (overridable with AI_MAX_WORKERS, AI_MAX_CONCURRENCY, and per backend with
+# AI_MAX_CONCURRENCY_<BACKEND NAME> or AI_MAX_CONCURRENCY_GEMINI / _OPENAI, see limit_name)
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PROVIDER_LIMIT = 2
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+# Backend name as it appears in a setting name: "gemini-2.5-flash" -> "GEMINI_2_5_FLASH"
+def limit_name(name):
+    return re.sub(r"[^A-Z0-9]+", "_", name.upper()).strip("_")
+
+
+class Job:
+    # One background analysis. Workers write, the UI only reads.
+
+    def __init__(self, owner, project, provider, payload=None, queue=None):
+        self.id = uuid4().hex
+        self.queue = queue
+        self.owner = owner
+        self.project = project
+        self.provider = provider
+        self.payload = payload or {}  # anything the UI needs back when the job ends
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.reasoning = ""  # live preview while streaming
+        self.tasks = []
+        self.messages = []  # warnings / errors shown under the job
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    # Progress callback handed to ophub.engine.run_analysis
+    def on_event(self, kind, value=None):
+        if kind == "reasoning":
+            self.reasoning += value
+        elif kind == "task":
+            self.tasks.append(value)
+        elif kind == "attempt":
+            self.reasoning = ""
+            self.tasks = []
+        elif kind in ("warning", "error"):
+            self.messages.append(value)
+        elif kind == "failover":
+            self.messages.append(f"Switching to {value}")
+        elif kind == "hedge":
+            self.messages.append(f"Slow answer, also asking {value}")
+        elif kind == "rules_hit":
+            self.messages.append("Answered from the guide rules, no model call")
+        elif kind == "similar_hit":
+            self.messages.append(f"Reused the analysis of near-identical notes ({value:.0%} similar)")
+
+    # Slot for another backend while this job runs (failover / hedging), see JobQueue.hold
+    def hold(self, provider, cancel_event=None):
+        return self.queue.hold(self, provider, cancel_event)
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED
+
+
+class JobQueue:
+    # Thread pool shared by every session, with a concurrency cap per backend.
+    # A job waits for its primary backend's slot while queued; backups it fails over or
+    # hedges to take their own slot through hold() for as long as they run.
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, provider_limits=None,
+                 default_limit=DEFAULT_PROVIDER_LIMIT):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> Job (insertion ordered)
+        self._limits = dict(provider_limits or {})
+        self._default_limit = default_limit
+        self._slots = {}  # provider -> Semaphore
+
+    def _slot(self, provider):
+        with self._lock:
+            if provider not in self._slots:
+                self._slots[provider] = threading.Semaphore(self._limits.get(provider, self._default_limit))
+            return self._slots[provider]
+
+    # work(job) does the analysis and returns its result
+    def submit(self, owner, project, provider, work, payload=None):
+        job = Job(owner, project, provider, payload, queue=self)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        slot = self._slot(job.provider)
+        # Wait for a provider slot, but stay cancellable while queued
+        while not slot.acquire(timeout=0.5):
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED)
+                return
+        try:
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED)
+                return
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                job.result = work(job)
+            except AnalysisCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, FAILED)
+            else:
+                self._finish(job, CANCELLED if job.cancel_event.is_set() else DONE)
+        finally:
+            slot.release()
+
+    @contextmanager
+    def hold(self, job, provider, cancel_event=None):
+        if provider == job.provider:  # taken by _run before the job started
+            yield
+            return
+        slot = self._slot(provider)
+        cancel_event = cancel_event or job.cancel_event
+        while not slot.acquire(timeout=0.5):
+            if cancel_event.is_set():
+                raise AnalysisCancelled()
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def _finish(self, job, status):
+        job.finished = time.time()
+        job.status = status
+
+    def jobs(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Queued jobs stop before starting; running ones stop at the next chunk/attempt
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.is_finished:
+            job.cancel_event.set()
+        return job
+
+    def forget(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    # Drop finished jobs nobody collected (e.g. the browser tab was closed)
+    def prune(self, max_age=3600):
+        cutoff = time.time() - max_age
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.is_finished and j.finished < cutoff]:
+                del self._jobs[job_id]
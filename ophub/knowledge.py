@@ -0,0 +1,280 @@
+import json
+import os
+import re
+import threading
+
+from ophub.rules import compile_rules
+
+# Defaults (overridable with AI_GUIDE_PATH, AI_KB_INDEX_PATH, AI_KB_TOP_K, AI_KB_CHUNK_CHARS, AI_KB_FULL_CHARS)
+DEFAULT_GUIDE_PATH = "guide.txt"  # a single file or a folder of .txt/.md guides
+DEFAULT_INDEX_PATH = os.path.join(".cache", "kb_index.json")
+DEFAULT_TOP_K = 6
+DEFAULT_CHUNK_CHARS = 1200
+DEFAULT_FULL_CHARS = 6000  # guides up to this size are sent whole (keeps the cached prefix stable)
+GUIDE_EXTENSIONS = (".txt", ".md")
+INDEX_VERSION = 1
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "has", "have",
+    "if", "in", "is", "it", "of", "on", "or", "our", "that", "the", "then", "this", "to", "we",
+    "with", "you",
+}
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+# Distinct tokens only (search index)
+def terms(text):
+    return set(_TOKEN.findall(text.lower())) - STOPWORDS
+
+
+def _term_counts(text):
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+# Paragraphs first, lines when a paragraph is too long, packed up to chunk_chars.
+# Returns [(first_line, text)] with 1-based line numbers.
+def chunk_text(text, chunk_chars=DEFAULT_CHUNK_CHARS):
+    pieces = []  # (line number, text)
+    paragraph, start = [], None
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            if start is None:
+                start = number
+            paragraph.append(line)
+            continue
+        if paragraph:
+            pieces.append((start, "\n".join(paragraph)))
+        paragraph, start = [], None
+    if paragraph:
+        pieces.append((start, "\n".join(paragraph)))
+
+    lines = []
+    for start, piece in pieces:
+        if len(piece) <= chunk_chars:
+            lines.append((start, piece, True))
+        else:
+            lines.extend((start + i, line, i == 0) for i, line in enumerate(piece.split("\n")))
+
+    chunks, current, first = [], [], None
+    size = 0
+    for number, piece, new_paragraph in lines:
+        if current and size + len(piece) > chunk_chars:
+            chunks.append((first, "\n".join(current)))
+            current, size = [], 0
+        if not current:
+            first = number
+        elif new_paragraph:
+            current.append("")  # keep the blank line between paragraphs
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append((first, "\n".join(current)))
+    return chunks
+
+
+def list_guides(path):
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for folder, _, names in os.walk(path):
+        for name in names:
+            if name.lower().endswith(GUIDE_EXTENSIONS):
+                found.append(os.path.join(folder, name))
+    return sorted(found)
+
+
+class KnowledgeBase:
+    # Chunked guides with a BM25 index.
+    # Per-file chunks and term counts are persisted, so a restart only re-reads files that
+    # changed (mtime/size), and the NumPy postings are rebuilt from the stored counts.
+
+    def __init__(self, path=DEFAULT_GUIDE_PATH, index_path=DEFAULT_INDEX_PATH,
+                 chunk_chars=DEFAULT_CHUNK_CHARS, full_chars=DEFAULT_FULL_CHARS):
+        self.path = path
+        self.index_path = index_path
+        self.chunk_chars = chunk_chars
+        self.full_chars = full_chars
+        self._lock = threading.Lock()
+        self._files = {}  # path -> {"mtime", "size", "text", "chunks": [{"line", "text", "counts"}]}
+        self._chunks = []  # (path, line, text) in document order
+        self._postings = None
+        self._rules = None  # RuleGraph of the current files, compiled on first use
+        self.rebuilds = 0
+        self._load_index()
+        self.refresh()
+
+    def _load_index(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return  # unreadable index: rebuilt from the files
+        if saved.get("version") == INDEX_VERSION and saved.get("chunk_chars") == self.chunk_chars:
+            self._files = saved.get("files", {})
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        folder = os.path.dirname(self.index_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "chunk_chars": self.chunk_chars, "files": self._files}, f)
+        os.replace(temp_path, self.index_path)
+
+    # Re-read new/changed files, drop removed ones. Returns True if anything changed.
+    def refresh(self):
+        with self._lock:
+            paths = list_guides(self.path) if os.path.exists(self.path) else []
+            changed = False
+            for removed in set(self._files) - set(paths):
+                del self._files[removed]
+                changed = True
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                known = self._files.get(path)
+                if known and known["mtime"] == stat.st_mtime and known["size"] == stat.st_size:
+                    continue
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+                self._files[path] = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "text": text,
+                    "chunks": [
+                        {"line": line, "text": chunk, "counts": _term_counts(chunk)}
+                        for line, chunk in chunk_text(text, self.chunk_chars)
+                    ],
+                }
+                changed = True
+            if changed or self._postings is None:
+                self._build()
+                self._rules = None
+            if changed:
+                self._save_index()
+            return changed
+
+    # Term -> (chunk ids, term frequencies), sorted by term so a query only reads its own postings
+    def _build(self):
+        import numpy as np
+
+        self._chunks = []
+        vocabulary = {}
+        chunk_ids, term_ids, frequencies, lengths = [], [], [], []
+        for path in sorted(self._files):
+            for chunk in self._files[path]["chunks"]:
+                chunk_id = len(self._chunks)
+                self._chunks.append((path, chunk["line"], chunk["text"]))
+                lengths.append(sum(chunk["counts"].values()))
+                for term, count in chunk["counts"].items():
+                    chunk_ids.append(chunk_id)
+                    term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                    frequencies.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        lengths = np.asarray(lengths, dtype=np.float64)
+        document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        total = len(self._chunks)
+        self._postings = {
+            "vocabulary": vocabulary,
+            "chunk_ids": np.asarray(chunk_ids, dtype=np.int64)[order],
+            "frequencies": np.asarray(frequencies, dtype=np.float64)[order],
+            "offsets": np.concatenate(([0], np.cumsum(document_frequency))),
+            "idf": np.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5)),
+            "norm": K1 * (1 - B + B * lengths / (lengths.mean() if total else 1.0)),
+        }
+        self.rebuilds += 1
+
+    def scores(self, query):
+        import numpy as np
+
+        postings = self._postings
+        scores = np.zeros(len(self._chunks))
+        for term in set(tokenize(query)):
+            term_id = postings["vocabulary"].get(term)
+            if term_id is None:
+                continue
+            start, end = postings["offsets"][term_id], postings["offsets"][term_id + 1]
+            ids = postings["chunk_ids"][start:end]
+            tf = postings["frequencies"][start:end]
+            scores[ids] += postings["idf"][term_id] * tf * (K1 + 1) / (tf + postings["norm"][ids])
+        return scores
+
+    # [(path, line, text, score)], best first
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        import numpy as np
+
+        with self._lock:
+            if not self._chunks:
+                return []
+            scores = self.scores(query)
+            top_k = min(top_k, len(scores))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            return [self._chunks[i] + (float(scores[i]),) for i in best if scores[i] > 0]
+
+    def total_chars(self):
+        with self._lock:
+            return sum(len(record["text"]) for record in self._files.values())
+
+    def _label(self, path):
+        if os.path.isfile(self.path):
+            return os.path.basename(path)
+        return os.path.relpath(path, self.path)
+
+    def full_text(self):
+        with self._lock:
+            if len(self._files) == 1:
+                return next(iter(self._files.values()))["text"]
+            return "\n\n".join(f"## {self._label(path)}\n{self._files[path]['text']}" for path in sorted(self._files))
+
+    # The guide text for one analysis: the whole guide while it is small,
+    # otherwise the top_k chunks for these notes, kept in document order.
+    def select(self, notes, top_k=DEFAULT_TOP_K):
+        self.refresh()
+        if self.total_chars() <= self.full_chars:
+            return self.full_text()
+        hits = self.search(notes, top_k)
+        if not hits:
+            return self.full_text()[:self.full_chars]
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        return "\n\n".join(f"## {self._label(path)} (line {line})\n{text}" for path, line, text, _ in hits)
+
+    # Prerequisite rules of the whole guide (ophub.rules), recompiled only after a file changed
+    def rules(self):
+        self.refresh()
+        with self._lock:
+            rules = self._rules
+        if rules is None:
+            rules = compile_rules(self.full_text())
+            with self._lock:
+                self._rules = rules
+        return rules
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "chunks": len(self._chunks),
+                "terms": len(self._postings["vocabulary"]) if self._postings else 0,
+                "rules": len(self._rules) if self._rules is not None else None,
+                "rebuilds": self.rebuilds,
+            }
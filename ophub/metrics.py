@@ -0,0 +1,286 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stages recorded for every analysis (ophub_stage_seconds{stage=...}):
+#   rules          resolving the notes with the guide rules (AI_RULES=1)
+#   cache_lookup   response cache read
+#   similar_lookup nearest earlier notes (AI_SIMILAR_MODE=auto)
+#   client         getting/creating the pooled SDK client
+#   prompt         building the prompt (includes creating a Gemini context cache)
+#   first_token    request sent -> first streamed text (network wait + model queue)
+#   generation     first streamed text -> answer complete
+#   request        whole blocking call (AI_STREAMING=0)
+#   parse          JSON cleanup / local repair
+#   backoff        sleeping between attempts
+#   total          the whole analysis
+#   save           writing the result into the history
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RECENT_SAMPLES = 200  # per series, for the percentiles in the diagnostics panel
+
+
+# Nearest-rank percentile of a list of numbers (None when empty); every p50/p95 in ophub and bench
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+HELP = {
+    "ophub_stage_seconds": ("histogram", "Time spent per analysis stage"),
+    "ophub_attempts_total": ("counter", "Model calls per provider, model and outcome"),
+    "ophub_analyses_total": ("counter", "Finished analyses per outcome"),
+    "ophub_tokens_total": ("counter", "Tokens reported by the provider APIs"),
+    "ophub_cost_usd_total": ("counter", "Estimated spend from AI_TOKEN_PRICES"),
+}
+
+
+class AnalysisTrace:
+    # Stage timings, attempts and token usage of one analysis.
+    # Shared by the hedging branches, hence the lock.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stages = []  # (stage, provider name, model, seconds)
+        self.attempts = []  # (provider name, model, outcome)
+        self.usage = {}  # (provider name, model) -> {"input": n, "output": n, "cached": n}
+        self.outcome = None
+        self.provider = None
+
+    def add(self, stage, seconds, target=None):
+        with self._lock:
+            self.stages.append((stage, target.name if target else "", target.model if target else "", seconds))
+
+    @contextmanager
+    def span(self, stage, target=None):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - started, target)
+
+    def attempt(self, target, outcome):
+        with self._lock:
+            self.attempts.append((target.name, target.model, outcome))
+
+    def add_usage(self, target, usage):
+        if not usage:
+            return
+        with self._lock:
+            totals = self.usage.setdefault((target.name, target.model), {"input": 0, "output": 0, "cached": 0})
+            for kind, count in usage.items():
+                totals[kind] = totals.get(kind, 0) + (count or 0)
+
+    def finish(self, outcome, provider=None):
+        self.outcome = outcome
+        self.provider = provider
+        self.add("total", time.monotonic() - self.started)
+
+    def to_dict(self):
+        with self._lock:
+            stages = {}
+            for stage, _, _, seconds in self.stages:
+                stages[stage] = round(stages.get(stage, 0.0) + seconds, 4)
+            return {
+                "outcome": self.outcome,
+                "provider": self.provider,
+                "stages": stages,
+                "attempts": [{"provider": p, "model": m, "outcome": o} for p, m, o in self.attempts],
+                "usage": [{"provider": p, "model": m, **counts} for (p, m), counts in self.usage.items()],
+            }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    # Process-wide counters and histograms, Prometheus style
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.prices = {}  # model -> {"input": usd per 1M tokens, "output": ..., "cached": ...}
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> {"counts", "sum", "count", "recent"}
+        self._sinks = []
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                          "recent": deque(maxlen=RECENT_SAMPLES)}
+                self._histograms[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    # Same label set as the engine's stages, so every ophub_stage_seconds series lines up
+    @contextmanager
+    def time(self, stage, provider="", model=""):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe("ophub_stage_seconds", time.monotonic() - started, stage=stage, provider=provider, model=model)
+
+    # sink(record_dict) is called once per finished analysis
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+
+    def cost(self, model, usage):
+        price = self.prices.get(model)
+        if not price:
+            return None
+        cached = usage.get("cached", 0)
+        return ((usage.get("input", 0) - cached) * price.get("input", 0)
+                + cached * price.get("cached", price.get("input", 0))
+                + usage.get("output", 0) * price.get("output", 0)) / 1e6
+
+    def record_analysis(self, trace):
+        for stage, provider, model, seconds in list(trace.stages):
+            self.observe("ophub_stage_seconds", seconds, stage=stage, provider=provider, model=model)
+        for provider, model, outcome in list(trace.attempts):
+            self.inc("ophub_attempts_total", provider=provider, model=model, outcome=outcome)
+        costs = {}
+        for (provider, model), usage in list(trace.usage.items()):
+            for kind, count in usage.items():
+                if count:
+                    self.inc("ophub_tokens_total", count, provider=provider, model=model, kind=kind)
+            cost = self.cost(model, usage)
+            if cost:
+                self.inc("ophub_cost_usd_total", cost, provider=provider, model=model)
+                costs[f"{provider}/{model}"] = round(cost, 6)
+        self.inc("ophub_analyses_total", outcome=trace.outcome or "unknown")
+
+        if self._sinks:
+            record = dict(trace.to_dict(), time=time.strftime("%Y-%m-%dT%H:%M:%S"), cost_usd=costs)
+            for sink in list(self._sinks):
+                try:
+                    sink(record)
+                except Exception:
+                    pass  # metrics must never break an analysis
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(value, counts=list(value["counts"])) for key, value in self._histograms.items()}
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            kind, text = HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_label_text(labels)} {value:g}")
+            for (series_name, labels), series in sorted(histograms.items(), key=lambda item: item[0]):
+                if series_name != name:
+                    continue
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{name}_sum{_label_text(labels)} {series['sum']:.6f}")
+                lines.append(f"{name}_count{_label_text(labels)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    # For the diagnostics panel / JSON: recent percentiles per stage and the counters
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value["recent"]), value["count"], value["sum"])
+                          for key, value in self._histograms.items()}
+        stages = []
+        for (name, labels), (recent, count, total) in sorted(histograms.items()):
+            stages.append(dict(
+                labels,
+                count=count,
+                mean=round(total / count, 4) if count else None,
+                p50=round(percentile(recent, 50), 4) if recent else None,
+                p95=round(percentile(recent, 95), 4) if recent else None,
+            ))
+        return {
+            "stages": stages,
+            "counters": [dict(labels, name=name, value=round(value, 6)) for (name, labels), value in sorted(counters.items())],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# The process-wide registry (like ophub.retry.totals)
+metrics = Metrics()
+
+
+class JsonLogSink:
+    # One JSON line per analysis, appended to a file ("-" for stderr)
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self.path == "-":
+                print(line, file=sys.stderr, flush=True)
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body, content_type = self.registry.render_prometheus(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(self.registry.snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+# GET /metrics (Prometheus text) and /metrics.json on a background thread
+def start_metrics_server(port, host="127.0.0.1", registry=None):
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,208 @@
+import json
+import threading
+from collections import deque, namedtuple
+
+from ophub.clients import load_client_settings
+from ophub.metrics import percentile
+
+DEFAULT_MODEL = "gpt-oss:20b"
+
+# Map old Gemini model names to new equivalents
+GEMINI_MODEL_MAPPING = {
+    "gemini-1.5-flash-latest": "gemini-2.5-flash",
+    "gemini-1.5-flash": "gemini-2.5-flash",
+    "gemini-1.5-pro-latest": "gemini-2.5-pro",
+    "gemini-1.5-pro": "gemini-2.5-pro",
+    "gemini-pro": "gemini-2.5-pro",
+    "gemini-flash": "gemini-2.5-flash",
+}
+
+# One backend in the failover order: name is for display/metrics, settings is a ClientSettings
+ProviderTarget = namedtuple("ProviderTarget", ["name", "provider", "model", "settings"])
+
+
+# Gemini (Cloud) or Ollama/OpenAI (Local) -> (provider, model)
+def resolve_model(model_name):
+    target_model = model_name or DEFAULT_MODEL
+    if "gemini" not in target_model.lower():
+        return "openai", target_model
+    target_model = target_model.replace("models/", "")
+    return "gemini", GEMINI_MODEL_MAPPING.get(target_model, target_model)
+
+
+# Ordered backends. AI_PROVIDERS is a JSON list such as
+#   [{"name": "gemini", "model": "gemini-2.5-flash", "api_key_env": "GEMINI_KEY"},
+#    {"name": "ollama", "model": "gpt-oss:20b", "base_url": "http://localhost:11434/v1", "api_key": "ollama"}]
+# Without it the single AI_MODEL_NAME / AI_BASE_URL / AI_API_KEY backend is used.
+def load_providers(get_secret):
+    raw = get_secret("AI_PROVIDERS")
+    if not raw:
+        model_name = get_secret("AI_MODEL_NAME")
+        provider, model = resolve_model(model_name)
+        name = "Gemini" if provider == "gemini" else "Ollama"
+        return [ProviderTarget(name, provider, model, load_client_settings(provider, get_secret))]
+
+    entries = json.loads(raw) if isinstance(raw, str) else list(raw)
+    targets = []
+    for entry in entries:
+        provider, model = resolve_model(entry.get("model"))
+        api_key = entry.get("api_key")
+        if api_key is None and entry.get("api_key_env"):
+            api_key = get_secret(entry["api_key_env"])
+        settings = load_client_settings(provider, get_secret)._replace(
+            api_key=api_key if api_key is not None else get_secret("AI_API_KEY"),
+            base_url=entry.get("base_url"),
+        )
+        targets.append(ProviderTarget(entry.get("name") or model, provider, model, settings))
+    return targets
+
+
+class LatencyTracker:
+    # Rolling window of successful call latencies per provider name
+
+    def __init__(self, window=50):
+        self._lock = threading.Lock()
+        self._samples = {}  # name -> deque of seconds
+        self._failures = {}
+        self._window = window
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self._window)).append(seconds)
+
+    def record_failure(self, name):
+        with self._lock:
+            self._failures[name] = self._failures.get(name, 0) + 1
+
+    def percentile(self, name, pct):
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        return percentile(samples, pct)
+
+    def stats(self):
+        with self._lock:
+            names = set(self._samples) | set(self._failures)
+            calls = {name: len(self._samples.get(name, ())) for name in names}
+            failures = dict(self._failures)
+        return {
+            name: {
+                "calls": calls[name],
+                "failures": failures.get(name, 0),
+                "p50": self.percentile(name, 50),
+                "p95": self.percentile(name, 95),
+            }
+            for name in sorted(names)
+        }
+
+
+# What gets sent for one call. With cached_content (Gemini) the system prompt and guide
+# already live server-side, so only the notes go in user_message.
+# extra_body carries backend-specific fields such as Ollama's keep_alive.
+Prompt = namedtuple("Prompt", ["system_instruction", "user_message", "cached_content", "extra_body"])
+Prompt.__new__.__defaults__ = (None, None)
+
+
+# Thin wrappers over the two SDK call styles (client comes from ophub.clients)
+
+# --- PATH A: GEMINI NATIVE ---
+def _gemini_config(prompt, temperature):
+    from google.genai import types
+
+    if prompt.cached_content:
+        return types.GenerateContentConfig(cached_content=prompt.cached_content, temperature=temperature)
+    return types.GenerateContentConfig(
+        system_instruction=prompt.system_instruction,
+        temperature=temperature,
+    )
+
+
+# --- PATH B: OLLAMA / OPENAI ---
+def _openai_messages(prompt):
+    return [
+        {"role": "system", "content": prompt.system_instruction},
+        {"role": "user", "content": prompt.user_message},
+    ]
+
+
+# Token counts from either SDK's usage object -> {"input", "output", "cached"}
+def _usage(provider, raw):
+    if raw is None:
+        return None
+    if provider == "gemini":
+        return {
+            "input": raw.prompt_token_count or 0,
+            "output": raw.candidates_token_count or 0,
+            "cached": raw.cached_content_token_count or 0,
+        }
+    details = getattr(raw, "prompt_tokens_details", None)
+    return {
+        "input": raw.prompt_tokens or 0,
+        "output": raw.completion_tokens or 0,
+        "cached": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+
+
+# Blocking call, returns the whole completion text.
+# Pass a dict as usage to get the token counts filled in.
+def complete(client, provider, model, prompt, temperature, timeout, usage=None):
+    if provider == "gemini":
+        response = client.models.generate_content(
+            model=model,
+            contents=prompt.user_message,
+            config=_gemini_config(prompt, temperature),
+        )
+        if usage is not None:
+            usage.update(_usage(provider, response.usage_metadata) or {})
+        return response.text
+
+    response = client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(prompt),
+        temperature=temperature,
+        timeout=timeout,
+        extra_body=prompt.extra_body,
+    )
+    if usage is not None:
+        usage.update(_usage(provider, response.usage) or {})
+    return response.choices[0].message.content
+
+
+# Streaming call, yields text pieces as they arrive.
+# Closing the generator early (break) also closes the HTTP stream.
+# usage (a dict) is filled in when the provider reports it, at the end of the stream.
+def stream(client, provider, model, prompt, temperature, timeout, usage=None):
+    if provider == "gemini":
+        response = client.models.generate_content_stream(
+            model=model,
+            contents=prompt.user_message,
+            config=_gemini_config(prompt, temperature),
+        )
+    else:
+        # the usage arrives in one extra chunk after the text
+        options = {"stream_options": {"include_usage": True}} if usage is not None else {}
+        response = client.chat.completions.create(
+            model=model,
+            messages=_openai_messages(prompt),
+            temperature=temperature,
+            timeout=timeout,
+            extra_body=prompt.extra_body,
+            stream=True,
+            **options,
+        )
+
+    try:
+        for chunk in response:
+            if provider == "gemini":
+                text = chunk.text
+                raw_usage = chunk.usage_metadata
+            else:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                raw_usage = getattr(chunk, "usage", None)
+            if usage is not None and raw_usage is not None:
+                usage.update(_usage(provider, raw_usage))  # totals so far; the last chunk wins
+            if text:
+                yield text
+    finally:
+        close = getattr(response, "close", None)
+        if close is not None:
+            close()
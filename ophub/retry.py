@@ -0,0 +1,238 @@
+import ast
+import json
+import random
+import re
+import threading
+
+# Error classes the retry loop cares about
+TRANSIENT = "transient"  # network / timeout / 5xx: back off and retry
+RATE_LIMIT = "rate_limit"  # 429: back off longer (honours Retry-After)
+AUTH = "auth"  # 401/403: retrying cannot help, fail fast
+FATAL = "fatal"  # 400/404/422: bad request or unknown model, fail fast
+PARSE = "parse"  # model answered but no JSON could be recovered
+EMPTY = "empty"  # model answered with nothing
+
+FAIL_FAST = (AUTH, FATAL)
+
+# Defaults (overridable with AI_MAX_ATTEMPTS, AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY)
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5  # seconds
+DEFAULT_MAX_DELAY = 20.0
+
+
+def _status_code(error):
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+# Works on openai / google-genai / httpx errors without importing either SDK
+def classify_error(error):
+    status = _status_code(error)
+    if status == 429:
+        return RATE_LIMIT
+    if status in (401, 403):
+        return AUTH
+    if status in (400, 404, 422):
+        return FATAL
+    if status is not None and (status >= 500 or status in (408, 409)):
+        return TRANSIENT
+
+    name = type(error).__name__
+    if "RateLimit" in name or "ResourceExhausted" in name:
+        return RATE_LIMIT
+    if "Authentication" in name or "PermissionDenied" in name:
+        return AUTH
+    if "NotFound" in name or "BadRequest" in name:
+        return FATAL
+    # Timeouts, dropped connections and anything unknown keep the old "just retry" behaviour
+    return TRANSIENT
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    # Exponential backoff with full jitter
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, kind, error=None):
+        if kind == PARSE:
+            return 0.0  # nothing wrong with the connection, ask again straight away
+        if kind == RATE_LIMIT:
+            hinted = retry_after(error) if error is not None else None
+            if hinted is not None:
+                return min(hinted, self.max_delay)
+            attempt += 1  # start one step further up the curve
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+# Format the AI response and convert the JSON list into checkboxes
+def parse_tasks(text):
+    # Search for a pattern starting with [ and ending with ]
+    match = re.search(r'\[.*\]', text, re.DOTALL)
+
+    if match:
+        # Extract only the bracketed part
+        clean_json = match.group(0)
+        task_names = json.loads(clean_json)
+        # Create the list of task dictionaries
+        return [{"task": name, "done": False} for name in task_names]
+
+    # If no brackets are found, trigger the fallback
+    raise ValueError("No JSON list found")
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        # single quotes, True/False/None
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+# Close strings/brackets left open by a cut-off completion. None when the cut fell inside an
+# array: the task list never closed, so its last task may be cut short and later ones missing.
+def _close_truncated(text):
+    stack = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if "]" in stack:
+        return None
+    tail = '"' if in_string else ""
+    return re.sub(r",\s*$", "", text + tail) + "".join(reversed(stack))
+
+
+def _as_result(data, require_tasks=False):
+    if not isinstance(data, dict) or not isinstance(data.get("tasks", []), list):
+        return None
+    if require_tasks and "tasks" not in data:
+        return None
+    return data
+
+
+# Local JSON recovery, tried before paying for another model call.
+# Returns the parsed dict or None.
+def repair_json(text):
+    if not text:
+        return None
+    clean_text = text.replace("```json", "").replace("```", "").strip()
+    clean_text = (clean_text.replace("“", '"').replace("”", '"')
+                  .replace("‘", "'").replace("’", "'"))
+
+    start = clean_text.find("{")
+    if start != -1:
+        end = clean_text.rfind("}")
+        candidates = []
+        if end > start:
+            body = clean_text[start:end + 1]
+            candidates += [(body, False), (re.sub(r",\s*([}\]])", r"\1", body), False)]
+        # a cut-off answer only counts if the whole task list made it in
+        truncated = _close_truncated(clean_text[start:])
+        if truncated is not None:
+            candidates.append((truncated, True))
+        for candidate, require_tasks in candidates:
+            data = _as_result(_loads(candidate), require_tasks)
+            if data is not None:
+                return data
+        if truncated is None:
+            return None  # cut inside the task list: ask again rather than guess
+
+    # Last resort: a bare list of task names (no reasoning)
+    try:
+        tasks = parse_tasks(clean_text)
+    except ValueError:
+        return None
+    return {"reasoning": "No reasoning provided.", "tasks": [task["task"] for task in tasks]}
+
+
+class AttemptStats:
+    # What happened during one analysis
+
+    def __init__(self):
+        self.attempts = 0
+        self.model_calls = 0
+        self.repairs = 0
+        self.backoff_seconds = 0.0
+        self.errors = {}  # kind -> count
+
+    def record_error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def merge(self, other):
+        self.attempts += other.attempts
+        self.model_calls += other.model_calls
+        self.repairs += other.repairs
+        self.backoff_seconds += other.backoff_seconds
+        for kind, count in other.errors.items():
+            self.errors[kind] = self.errors.get(kind, 0) + count
+
+    def to_dict(self):
+        return {
+            "attempts": self.attempts,
+            "model_calls": self.model_calls,
+            "repairs": self.repairs,
+            "backoff_seconds": round(self.backoff_seconds, 3),
+            "errors": dict(self.errors),
+        }
+
+
+class RetryTotals:
+    # Running totals across every analysis in this process
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {"analyses": 0, "attempts": 0, "model_calls": 0, "repairs": 0,
+                        "backoff_seconds": 0.0, "failures": 0, "errors": {}}
+
+    def add(self, stats, failed=False):
+        with self._lock:
+            self._totals["analyses"] += 1
+            self._totals["failures"] += int(failed)
+            for key in ("attempts", "model_calls", "repairs", "backoff_seconds"):
+                self._totals[key] += getattr(stats, key)
+            for kind, count in stats.errors.items():
+                self._totals["errors"][kind] = self._totals["errors"].get(kind, 0) + count
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self._totals)
+            snapshot["errors"] = dict(self._totals["errors"])
+            return snapshot
+
+
+totals = RetryTotals()
@@ -0,0 +1,241 @@
+import re
+
+# Answers that come from the guide rules instead of a model ("provider" of the result)
+RULES_PROVIDER = "guide rules"
+
+# Guide sentences understood by compile_rules:
+#   if we don't have a SAN, then we need one.                      SAN has no prerequisites
+#   if we have the SAN, Client Acceptance can be requested to KYC.  CA needs SAN
+#   if we need to open a job, we need a SAN, a signed EL and an EA. the goal needs all three
+#   an EA requires Client Acceptance.                              same as "if we have ..."
+_ROOT = re.compile(r"^if we (?:don't|do not|dont) have (?P<item>.+?),\s*(?:then\s+)?we need (?:one|it)$", re.I)
+_ENABLES = re.compile(r"^if we have (?P<needs>.+?),\s*(?:then\s+)?(?P<item>.+?) can be (?P<verb>[a-z]+)\b.*$", re.I)
+_GOAL = re.compile(r"^(?:if |when )?we (?:need|want) to (?P<goal>.+?),\s*(?:then\s+)?we need (?P<needs>.+)$", re.I)
+_REQUIRES = re.compile(r"^(?P<item>.+?) (?:requires|needs) (?P<needs>.+)$", re.I)
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_LIST = re.compile(r",\s*(?:and\s+)?|\s+and\s+")
+_ARTICLES = re.compile(r"\b(?:a|an|the)\s+", re.I)
+_PARENTHESES = re.compile(r"^(?P<name>.+?)\s*\((?P<inner>[^)]+)\)$")
+
+# "X can be requested" -> "Request X"
+VERBS = {
+    "requested": "Request", "done": "Complete", "completed": "Complete", "performed": "Perform",
+    "signed": "Sign", "sent": "Send", "issued": "Issue", "opened": "Open", "approved": "Approve",
+    "submitted": "Submit", "created": "Create", "filed": "File", "obtained": "Obtain",
+}
+DEFAULT_VERB = "Obtain"
+
+# How the notes talk about the items after these words. At the same spot the first group
+# wins, so "have to" is a need and "don't have" is missing, not held.
+_MARKERS = re.compile(
+    r"\b(?:(?P<missing>no|not|without|missing|lack(?:s|ing)?|don't have|dont have|do not have|haven't|"
+    r"have not|hasn't|has not|doesn't have|does not have|yet to|except|waiting|awaiting|pending|"
+    r"rejected|expired|refused|declined|revoked|cancelled|canceled|on hold)"
+    r"|(?P<needed>needs?|needed|wants?|must|have to|has to|would like|trying to|plan(?:s|ning)? to|"
+    r"going to|asked to)"
+    r"|(?P<held>have|has|had|got|received|obtained|hold(?:ing)?|already|done|completed|in place|"
+    r"in hand|approved|signed))\b"
+)
+_CLAUSE = re.compile(r"[.;!?\n]+|\b(?:but|however|although|since|because)\b")
+# Words that may sit around the items without saying anything the rules can't read
+# ("I have everything except the EA", "the SAN has expired" must go to the model)
+_FILLER = {
+    "to", "and", "or", "also", "still", "only", "first", "then", "now", "so", "we", "i", "they", "you",
+    "us", "it", "our", "their", "client", "for", "get", "getting", "be", "do", "please", "asap", "soon",
+    "urgently", "yet", "i'm", "we're", "they're", "is", "are", "was", "were", "been", "both",
+} | {verb.lower() for verb in VERBS.values()}
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def _plain(text):
+    text = _ARTICLES.sub("", text.lower().replace("+", " and ").replace("\u2019", "'"))
+    return re.sub(r"\s+", " ", text).strip(" .")
+
+
+def _aliases(phrase):
+    aliases = {_plain(phrase)}
+    if all(re.fullmatch(r"[A-Z][A-Z0-9]+", word) for word in phrase.split()):  # "EL" of "signed EL" is another thing
+        aliases.update(token.lower() for token in phrase.split())
+    capitals = re.findall(r"\b[A-Z][a-z]+", phrase)
+    if len(capitals) > 1 and len(capitals) == len(phrase.split()):  # "Client Acceptance" -> ca
+        aliases.add("".join(word[0] for word in capitals).lower())
+    return aliases
+
+
+class RuleGraph:
+    # Prerequisite DAG compiled from the guide, see compile_rules.
+    # resolve(notes) answers without a model when the notes only talk about items the
+    # guide knows: what is held, what is wanted, and in which order the missing steps come.
+
+    def __init__(self):
+        self.items = []  # {"name", "action", "needs": set of item indexes, "rule": guide sentence}
+        self._alias_items = {}  # alias -> item index
+        self._pattern = None
+
+    def __len__(self):
+        return len(self.items)
+
+    # Every name the notes may use for an item ("client acceptance", "ca", ...)
+    def aliases(self):
+        return set(self._alias_items)
+
+    def _item(self, phrase, action=None):
+        phrase = phrase.strip(" .")
+        inner = None
+        match = _PARENTHESES.match(phrase)
+        if match:
+            phrase, inner = match.group("name"), match.group("inner")
+        phrase = re.sub(r"^(?:a|an|the)\s+", "", phrase, flags=re.I).strip()
+        aliases = _aliases(phrase) | (_aliases(inner) if inner else set())
+        index = next((self._alias_items[alias] for alias in aliases if alias in self._alias_items), None)
+        if index is None:
+            index = len(self.items)
+            self.items.append({"name": phrase, "action": None, "needs": set(), "rule": None})
+        for alias in aliases:
+            self._alias_items.setdefault(alias, index)
+        if action and not self.items[index]["action"]:
+            self.items[index]["action"] = action
+        return index
+
+    def _needs(self, index, phrases, rule):
+        item = self.items[index]
+        item["needs"].update(self._item(phrase) for phrase in _LIST.split(phrases.strip(" .")) if phrase.strip())
+        item["needs"].discard(index)
+        item["rule"] = item["rule"] or rule
+
+    def _add_sentence(self, sentence):
+        sentence = sentence.strip().rstrip(".!")
+        match = _ROOT.match(sentence)
+        if match:
+            index = self._item(match.group("item"))
+            self.items[index]["rule"] = self.items[index]["rule"] or sentence
+            return True
+        match = _ENABLES.match(sentence)
+        if match:
+            verb = VERBS.get(match.group("verb").lower(), DEFAULT_VERB)
+            index = self._item(match.group("item"))
+            name = self.items[index]["name"]
+            self.items[index]["action"] = self.items[index]["action"] or f"{verb} {name}"
+            self._needs(index, match.group("needs"), sentence)
+            return True
+        match = _GOAL.match(sentence)
+        if match:
+            goal = match.group("goal").strip()
+            index = self._item(goal, action=goal[:1].upper() + goal[1:])
+            self._needs(index, match.group("needs"), sentence)
+            return True
+        match = _REQUIRES.match(sentence)
+        if match:
+            self._needs(self._item(match.group("item")), match.group("needs"), sentence)
+            return True
+        return False
+
+    # Every alias in one alternation, longest first ("signed el" before "el")
+    def _finish(self):
+        aliases = sorted(self._alias_items, key=len, reverse=True)
+        self._pattern = re.compile(r"\b(?:%s)\b" % "|".join(map(re.escape, aliases))) if aliases else None
+        self._order = self._topological_order()
+
+    def _topological_order(self):
+        order, seen, visiting = [], set(), set()
+
+        def visit(index):
+            if index in seen or index in visiting:  # a cycle in the guide: keep going, order as written
+                return
+            visiting.add(index)
+            for need in sorted(self.items[index]["needs"]):
+                visit(need)
+            visiting.discard(index)
+            seen.add(index)
+            order.append(index)
+
+        for index in range(len(self.items)):
+            visit(index)
+        return {index: position for position, index in enumerate(order)}
+
+    def _prerequisites(self, indexes):
+        found, stack = set(), list(indexes)
+        while stack:
+            for need in self.items[stack.pop()]["needs"]:
+                if need not in found:
+                    found.add(need)
+                    stack.append(need)
+        return found
+
+    def _label(self, index):
+        return self.items[index]["name"]
+
+    def _join(self, indexes):
+        names = [self._label(index) for index in sorted(indexes, key=self._order.get)]
+        return names[0] if len(names) == 1 else ", ".join(names[:-1]) + " and " + names[-1]
+
+    # (held, wanted) item indexes, or None when the notes can't be read with the rules.
+    # An item takes the meaning of the last marker before it in its clause (or the first after).
+    # Every word after a marker has to be an item or filler, otherwise the model decides:
+    # "I have everything except the EA" is not "I have the EA". A need or a negation with no
+    # item after it is about something earlier ("the SAN has expired"), which is left to the model too.
+    def _read(self, notes):
+        held, wanted, missing = set(), set(), set()
+        found = {"held": held, "needed": wanted, "missing": missing}
+        for clause in _CLAUSE.split(_plain(notes)):
+            mentions = list(self._pattern.finditer(clause))
+            # "signed" of "signed EL" is part of the item, not a marker
+            markers = [marker for marker in _MARKERS.finditer(clause)
+                       if not any(mention.start() <= marker.start() < mention.end() for mention in mentions)]
+            if mentions and not markers:
+                return None  # items without a have/need: leave it to the model
+            for mention in mentions:
+                before = [marker for marker in markers if marker.start() < mention.start()]
+                marker = before[-1] if before else markers[0]
+                found[marker.lastgroup].add(self._alias_items[mention.group(0)])
+            if markers and mentions and mentions[0].start() < markers[0].start():
+                # "the SAN and CA are in place": only filler next to items before the first marker
+                if self._unread(clause[:markers[0].start()]):
+                    return None
+            for position, marker in enumerate(markers):
+                end = markers[position + 1].start() if position + 1 < len(markers) else len(clause)
+                span = clause[marker.end():end]
+                if self._unread(span):
+                    return None
+                if marker.lastgroup in ("needed", "missing") and not self._pattern.search(span):
+                    return None  # "need to schedule the audit": the audit has no rule
+        held -= missing | wanted
+        return held, wanted
+
+    def _unread(self, text):
+        return bool(set(_WORD.findall(self._pattern.sub(" ", text))) - _FILLER)
+
+    # {"reasoning", "tasks"} or None (the model handles it)
+    def resolve(self, notes):
+        if self._pattern is None:
+            return None
+        read = self._read(notes)
+        if read is None or not read[1]:
+            return None
+        held, wanted = read
+        done = held | self._prerequisites(held)  # having EA means CA and SAN were in place
+        steps = (wanted | self._prerequisites(wanted)) - done
+        steps = sorted(steps, key=self._order.get)
+
+        lines = [f"From the notes you have {self._join(held)}." if held else
+                 "The notes don't mention any prerequisite already in place."]
+        for index in sorted(wanted | {step for step in steps if self.items[step]["needs"]}, key=self._order.get):
+            if self.items[index]["needs"]:
+                lines.append(f"Per the guide, {self._label(index)} needs {self._join(self.items[index]['needs'])}.")
+        if steps:
+            lines.append(f"Still missing, in order: {', '.join(self._label(step) for step in steps)}.")
+        else:
+            lines.append(f"Everything needed for {self._join(wanted)} is already in place.")
+        tasks = [self.items[step]["action"] or f"{DEFAULT_VERB} {self._label(step)}" for step in steps]
+        return {"reasoning": " ".join(lines), "tasks": tasks}
+
+
+# Guide text -> RuleGraph. Sentences that don't follow one of the patterns above are skipped.
+def compile_rules(text):
+    graph = RuleGraph()
+    for sentence in _SENTENCE.split(text or ""):
+        if sentence.strip() and not sentence.lstrip().startswith("#"):
+            graph._add_sentence(sentence)
+    graph._finish()
+    return graph
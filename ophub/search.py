@@ -0,0 +1,134 @@
+from bisect import bisect_left, insort
+from itertools import islice
+
+from ophub.knowledge import terms as text_terms, tokenize
+
+OPEN = "open"  # entries with at least one unticked task
+COMPLETED = "completed"  # entries whose tasks are all ticked
+SMALL_RESULT = 2000  # below this results are sorted; above, the recency order is walked instead
+
+
+class HistoryIndex:
+    # In-memory inverted index over the history: project name, reasoning and task text.
+    # Kept up to date one entry at a time (add/remove/update_tasks), so a search never walks
+    # the entries. Every query word matches as a prefix ("acm" finds "Acme") and all words must
+    # match; entries with every word in their name come first, then newest first.
+
+    def __init__(self, entries=()):
+        self._postings = {}  # term -> ids (name, reasoning or tasks)
+        self._name_postings = {}  # term -> ids (name only)
+        self._terms = []  # sorted vocabulary, for prefix lookups
+        self._entry_terms = {}  # id -> (terms, name terms), to take an entry out again
+        self._recency = {}  # id -> counter; insertion order is also newest last
+        self._counter = 0
+        self._open = set()
+        self._completed = set()
+        self._changes = 0  # bumped by every change, invalidates _last
+        self._last = None  # (changes, query, status, limit, ids): reruns repeat the same search
+        for entry in entries:  # oldest first; the vocabulary is sorted once at the end
+            self.add(entry, _sort=False)
+        self._terms = sorted(self._postings)
+
+    def __len__(self):
+        return len(self._entry_terms)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._entry_terms
+
+    def add(self, entry, _sort=True):
+        entry_id = entry["id"]
+        if entry_id in self._entry_terms:
+            self.remove(entry_id, keep_recency=True)
+        if entry_id not in self._recency:
+            self._counter += 1
+            self._recency[entry_id] = self._counter
+        name_terms = text_terms(entry.get("project") or "")
+        texts = [entry.get("reasoning") or ""] + [task.get("task") or "" for task in entry.get("tasks") or []]
+        terms = name_terms | text_terms(" ".join(texts))
+        for term in terms:
+            ids = self._postings.get(term)
+            if ids is None:
+                ids = self._postings[term] = set()
+                if _sort:
+                    insort(self._terms, term)
+            ids.add(entry_id)
+        for term in name_terms:
+            self._name_postings.setdefault(term, set()).add(entry_id)
+        self._entry_terms[entry_id] = (terms, name_terms)
+        self.update_tasks(entry)
+
+    def remove(self, entry_id, keep_recency=False):
+        self._changes += 1
+        terms, name_terms = self._entry_terms.pop(entry_id, ((), ()))
+        for term in terms:
+            ids = self._postings[term]
+            ids.discard(entry_id)
+            if not ids:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+        for term in name_terms:
+            ids = self._name_postings[term]
+            ids.discard(entry_id)
+            if not ids:
+                del self._name_postings[term]
+        self._open.discard(entry_id)
+        self._completed.discard(entry_id)
+        if not keep_recency:
+            self._recency.pop(entry_id, None)
+
+    # Tick/untick only moves the entry between the open/completed sets
+    def update_tasks(self, entry):
+        self._changes += 1
+        entry_id = entry["id"]
+        tasks = entry.get("tasks") or []
+        self._open.discard(entry_id)
+        self._completed.discard(entry_id)
+        if not all(task.get("done") for task in tasks):
+            self._open.add(entry_id)
+        elif tasks:
+            self._completed.add(entry_id)
+
+    def _prefix_terms(self, prefix):
+        start = bisect_left(self._terms, prefix)
+        end = start
+        while end < len(self._terms) and self._terms[end].startswith(prefix):
+            end += 1
+        return self._terms[start:end]
+
+    def _newest(self, ids, limit):
+        if len(ids) <= SMALL_RESULT:
+            return sorted(ids, key=self._recency.__getitem__, reverse=True)[:limit]
+        return list(islice((entry_id for entry_id in reversed(self._recency) if entry_id in ids), limit))
+
+    # Ids, best match first (then newest). status=OPEN/COMPLETED filters; an empty query with
+    # a status lists every entry in that state, newest first.
+    def search(self, query, status=None, limit=None):
+        if self._last is not None and self._last[:4] == (self._changes, query, status, limit):
+            return list(self._last[4])
+        results = self._search(query, status, limit)
+        self._last = (self._changes, query, status, limit, results)
+        return list(results)
+
+    def _search(self, query, status, limit):
+        allowed = {OPEN: self._open, COMPLETED: self._completed}.get(status)
+        prefixes = list(dict.fromkeys(tokenize(query)))
+        if not prefixes:
+            return [] if allowed is None else self._newest(allowed, limit)
+
+        matches, name_matches = [], []
+        for prefix in prefixes:
+            terms = self._prefix_terms(prefix)
+            if not terms:
+                return []
+            matches.append(set().union(*(self._postings[term] for term in terms)))
+            name_matches.append(set().union(*(self._name_postings.get(term, ()) for term in terms)))
+        matches.sort(key=len)  # intersect from the rarest word
+        found = matches[0].intersection(*matches[1:])
+        if allowed is not None:
+            found &= allowed
+        in_name = found.intersection(*name_matches)
+        results = self._newest(in_name, limit)
+        if limit is None or len(results) < limit:
+            rest = self._newest(found - in_name, None if limit is None else limit - len(results))
+            results += rest
+        return results
@@ -0,0 +1,248 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from ophub.cache import normalize_notes
+from ophub.context_cache import guide_fingerprint
+from ophub.knowledge import terms
+from ophub.rules import compile_rules
+
+# Defaults (overridable with AI_SIMILAR_MODE, AI_SIMILAR_THRESHOLD, AI_SIMILAR_PATH, AI_SIMILAR_MAX_ITEMS)
+OFF, OFFER, AUTO = "off", "offer", "auto"  # AI_SIMILAR_MODE
+DEFAULT_SIMILAR_PATH = os.path.join(".cache", "similar_notes.sqlite3")
+DEFAULT_THRESHOLD = 0.65  # cosine similarity, on top of the same-meaning check (see same_meaning)
+DEFAULT_MAX_ITEMS = 2000  # newest analyses kept
+NGRAM_SIZES = (3, 4, 5)
+HASH_BITS = 20  # n-grams are hashed into 2**20 columns (crc32, so stable across processes)
+
+Match = namedtuple("Match", "score notes result created")
+
+_WORD = re.compile(r"\w+")
+
+# Words that say whether something is there or still needed. With the guide's own words and
+# rule items, two notes that differ in any of them need their own analysis.
+STATUS_WORDS = {
+    "no", "not", "t", "don", "dont", "doesn", "didn", "haven", "hasn", "hadn", "isn", "aren", "wasn", "weren",
+    "never", "none", "nobody", "nothing", "without", "missing", "lack", "lacks", "lacking", "except",
+    "but", "only", "yet", "still", "waiting", "awaiting", "pending", "rejected", "expired", "refused",
+    "declined", "revoked", "cancelled", "canceled", "hold", "have", "has", "had", "got", "received",
+    "obtained", "already", "done", "completed", "approved", "signed", "need", "needs", "needed",
+    "want", "wants", "must", "all", "both", "every", "everything", "and", "or",
+}
+TYPO_CUTOFF = 0.75  # difflib ratio at which a word only on one side is a typo of one on the other
+MAX_OTHER_WORDS = 3  # words only one side has: a client name or a date, not another request
+
+
+def _words(notes):
+    return _WORD.findall(normalize_notes(notes).lower().replace("&", " and ").replace("+", " and "))
+
+
+# Character n-gram counts of the notes' words (case and punctuation don't count), {column: count}
+def ngram_counts(notes):
+    text = f" {' '.join(_words(notes))} "
+    mask = (1 << HASH_BITS) - 1
+    counts = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            column = zlib.crc32(text[i:i + n].encode("utf-8")) & mask
+            counts[column] = counts.get(column, 0) + 1
+    return counts
+
+
+# Guide words and every word of the rule item names ("ca" for Client Acceptance)
+def guide_vocabulary(kb):
+    graph = compile_rules(kb)
+    return terms(kb) | set(_WORD.findall(" ".join(graph.aliases()))) | STATUS_WORDS
+
+
+# True when the words only one of the notes has are a few words outside the vocabulary: a
+# client name, a date. A word a letter or two off from a word of the other notes, and about as
+# long, is a typo ("opne"/"open", but not "signed"/"unsigned" and never a status word).
+# "I only have a SAN" vs "I only have a SAN and CA" differ in "and" and "ca", so they don't match.
+def same_meaning(vocabulary, notes, other):
+    words, other_words = set(_words(notes)), set(_words(other))
+    only, other_only = words - other_words, other_words - words
+    for word in sorted(only - STATUS_WORDS):
+        typo = difflib.get_close_matches(word, other_only - STATUS_WORDS, n=1, cutoff=TYPO_CUTOFF)
+        if typo and abs(len(typo[0]) - len(word)) <= 1:
+            only.discard(word)
+            other_only.discard(typo[0])
+    if len(only) > MAX_OTHER_WORDS or len(other_only) > MAX_OTHER_WORDS:
+        return False
+    return not (only | other_only) & vocabulary
+
+
+class SimilarNotes:
+    # Earlier analyses by notes, found again by TF-IDF cosine over character n-grams, so the
+    # same notes with another client name, reworded punctuation or a typo still match.
+    # Only answers made with the same guide text count (guide_fingerprint of the selected guide),
+    # and best() only reuses one whose notes say the same about the guide (same_meaning).
+    # Kept in a SQLite table; the vectors are rebuilt in memory on the first lookup after a change.
+
+    def __init__(self, path=DEFAULT_SIMILAR_PATH, threshold=DEFAULT_THRESHOLD, max_items=DEFAULT_MAX_ITEMS):
+        self.path = path
+        self.threshold = threshold
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = []  # {"id", "guide", "notes", "result", "created", "counts"}, oldest first
+        self._matrix = None  # numpy arrays for the current _items, see _build
+        self._next_id = 1
+        self._vocabularies = {}  # guide fingerprint -> guide_vocabulary
+        self._db = None
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS notes ("
+                " id INTEGER PRIMARY KEY, guide TEXT NOT NULL, notes TEXT NOT NULL,"
+                " result TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id, guide, notes, result, created FROM notes ORDER BY id DESC LIMIT ?", (max_items,)
+            ).fetchall()
+            for row in reversed(rows):
+                self._items.append({"id": row[0], "guide": row[1], "notes": row[2], "result": json.loads(row[3]),
+                                    "created": row[4], "counts": ngram_counts(row[2])})
+            if rows:
+                self._next_id = rows[0][0] + 1
+
+    def __len__(self):
+        return len(self._items)
+
+    # One CSR-like set of arrays for all items: nonzeros sorted by item, TF-IDF weights
+    # (sublinear tf) and the row norms. IDF only changes with the items, so this is
+    # computed once per change, not per lookup.
+    def _build(self):
+        import numpy as np
+
+        rows, columns, counts = [], [], []
+        for row, item in enumerate(self._items):
+            rows.extend([row] * len(item["counts"]))
+            columns.extend(item["counts"].keys())
+            counts.extend(item["counts"].values())
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        vocabulary, inverse, document_frequency = np.unique(columns, return_inverse=True, return_counts=True)
+        total = len(self._items)
+        idf = np.log((1 + total) / (1 + document_frequency)) + 1
+        weights = (1 + np.log(np.asarray(counts, dtype=np.float64))) * idf[inverse]
+        self._matrix = {
+            "rows": rows,
+            "terms": inverse,  # position in vocabulary of every nonzero
+            "weights": weights,
+            "norms": np.sqrt(np.bincount(rows, weights * weights, minlength=total)),
+            "vocabulary": vocabulary,
+            "idf": idf,
+            "unseen_idf": np.log(1 + total) + 1,
+            "guides": np.asarray([item["guide"] for item in self._items]),
+        }
+
+    # Up to top_k earlier analyses for the same guide, most similar first (no threshold)
+    def find(self, kb, notes, top_k=3):
+        import numpy as np
+
+        guide = guide_fingerprint(kb)
+        query = ngram_counts(notes)
+        with self._lock:
+            if not self._items or not query:
+                return []
+            if self._matrix is None:
+                self._build()
+            matrix = self._matrix
+            items = list(self._items)
+
+        columns = np.fromiter(query.keys(), dtype=np.int64, count=len(query))
+        positions = np.minimum(np.searchsorted(matrix["vocabulary"], columns), len(matrix["vocabulary"]) - 1)
+        known = matrix["vocabulary"][positions] == columns
+        idf = np.where(known, matrix["idf"][positions], matrix["unseen_idf"])
+        weights = (1 + np.log(np.fromiter(query.values(), dtype=np.float64, count=len(query)))) * idf
+
+        # Only n-grams the items share can add to a dot product; the unseen ones still count in the norm
+        dense = np.zeros(len(matrix["vocabulary"]))
+        dense[positions[known]] = weights[known]
+        dots = np.bincount(matrix["rows"], matrix["weights"] * dense[matrix["terms"]], minlength=len(items))
+        scores = dots / np.maximum(matrix["norms"] * np.sqrt(weights @ weights), 1e-12)
+        scores[matrix["guides"] != guide] = -1.0
+
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+        else:
+            best = np.argsort(-scores)
+        return [Match(float(scores[row]), items[row]["notes"], items[row]["result"], items[row]["created"])
+                for row in best if scores[row] > 0]
+
+    def _vocabulary(self, kb):
+        guide = guide_fingerprint(kb)
+        with self._lock:
+            vocabulary = self._vocabularies.get(guide)
+        if vocabulary is None:
+            vocabulary = guide_vocabulary(kb)
+            with self._lock:
+                if len(self._vocabularies) >= 16:  # guide edits / chunk selections: keep a few
+                    self._vocabularies.clear()
+                self._vocabularies[guide] = vocabulary
+        return vocabulary
+
+    # The closest earlier analysis that reaches the threshold and says the same about the
+    # guide, else None
+    def best(self, kb, notes, top_k=5):
+        matches = [match for match in self.find(kb, notes, top_k=top_k) if match.score >= self.threshold]
+        vocabulary = self._vocabulary(kb) if matches else None
+        match = next((match for match in matches if same_meaning(vocabulary, notes, match.notes)), None)
+        with self._lock:
+            if match:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return match
+
+    # Same guide + same normalized notes replaces the older answer
+    def add(self, kb, notes, result):
+        guide = guide_fingerprint(kb)
+        normalized = normalize_notes(notes)
+        result = {key: value for key, value in result.items() if key != "similarity"}
+        now = time.time()
+        with self._lock:
+            stale = [item["id"] for item in self._items
+                     if item["guide"] == guide and normalize_notes(item["notes"]) == normalized]
+            self._items = [item for item in self._items if item["id"] not in stale]
+            item = {"id": self._next_id, "guide": guide, "notes": notes, "result": result, "created": now,
+                    "counts": ngram_counts(notes)}
+            self._next_id += 1
+            self._items.append(item)
+            dropped = [old["id"] for old in self._items[:-self.max_items]] if len(self._items) > self.max_items else []
+            self._items = self._items[-self.max_items:]
+            self._matrix = None
+            if self._db is None:
+                return
+            self._db.executemany("DELETE FROM notes WHERE id = ?", [(item_id,) for item_id in stale + dropped])
+            self._db.execute(
+                "INSERT INTO notes (id, guide, notes, result, created) VALUES (?, ?, ?, ?, ?)",
+                (item["id"], guide, notes, json.dumps(result, ensure_ascii=False), now),
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._items = []
+            self._matrix = None
+            if self._db is not None:
+                self._db.execute("DELETE FROM notes")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "hits": self.hits, "misses": self.misses,
+                    "threshold": self.threshold}
@@ -0,0 +1,154 @@
+import json
+import re
+
+# Events produced by IncrementalJSONParser.feed()
+REASONING = "reasoning"  # value: new piece of the reasoning string
+TASK = "task"  # value: one finished entry of the tasks array
+DONE = "done"  # value: the whole parsed object
+
+# First half of a UTF-16 surrogate pair ("\ud83d" of "\ud83d\ude80", an emoji)
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+
+
+class IncrementalJSONParser:
+    # Reads the {"reasoning": ..., "tasks": [...]} object one chunk at a time.
+    # Anything before the first "{" (e.g. a ```json fence) is skipped.
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.tasks = []
+        self.reasoning = ""
+        self._raw = []  # text of the object seen so far
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = None  # pending escape sequence, e.g. "\\u00"
+        self._high = None  # high surrogate escape waiting for its low half
+        self._string = []
+        self._expect_key = True  # only tracked at depth 1
+        self._key = None
+        self._in_tasks = False
+        self._task_start = None  # raw offset of a non-string task entry
+
+    def feed(self, chunk):
+        events = []
+        reasoning_delta = []
+        for ch in chunk:
+            if self.done:
+                break
+            if not self._started:
+                if ch != "{":
+                    continue
+                self._started = True
+            self._raw.append(ch)
+
+            if self._in_string:
+                decoded = self._string_char(ch)
+                if decoded is None:
+                    continue
+                ended = decoded is _END
+                if ended:  # a lone high surrogate at the end is kept, like json.loads does
+                    decoded = self._decode("") if self._high is not None else ""
+                self._string.append(decoded)
+                if self._streaming_reasoning():
+                    reasoning_delta.append(decoded)
+                if ended:
+                    self._end_string(events)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string = []
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 2 and ch == "[" and self._key == "tasks":
+                    self._in_tasks = True
+                elif self._in_tasks and self._depth == 3:
+                    self._task_start = len(self._raw) - 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._in_tasks and self._depth == 2 and self._task_start is not None:
+                    # non-string task (e.g. {"task": ...}); emit it once it closes
+                    text = "".join(self._raw[self._task_start:])
+                    self._task_start = None
+                    try:
+                        self._emit_task(json.loads(text), events)
+                    except ValueError:
+                        pass
+                elif self._in_tasks and self._depth == 1:
+                    self._in_tasks = False
+                elif self._depth == 0:
+                    self._finish(events)
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                elif ch == ",":
+                    self._expect_key = True
+
+        if reasoning_delta:
+            events.insert(0, (REASONING, "".join(reasoning_delta)))
+            self.reasoning += "".join(reasoning_delta)
+        return events
+
+    def _streaming_reasoning(self):
+        return self._in_string and self._depth == 1 and not self._expect_key and self._key == "reasoning"
+
+    # Returns the decoded text, None while an escape is incomplete, or _END.
+    # A surrogate pair is decoded as one character, so it waits for both escapes.
+    def _string_char(self, ch):
+        if self._escape is not None:
+            self._escape += ch
+            if self._escape[1] == "u" and len(self._escape) < 6:
+                return None
+            sequence, self._escape = self._escape, None
+            if _HIGH_SURROGATE.match(sequence):
+                lone = self._decode("") if self._high is not None else None
+                self._high = sequence
+                return lone
+            return self._decode(sequence)
+        if ch == "\\":
+            self._escape = ch
+            return None
+        if ch == '"':
+            return _END
+        return self._decode("") + ch if self._high is not None else ch
+
+    def _decode(self, sequence):
+        sequence, self._high = (self._high or "") + sequence, None
+        try:
+            return json.loads('"' + sequence + '"')
+        except ValueError:
+            return sequence
+
+    def _end_string(self, events):
+        self._in_string = False
+        value = "".join(self._string)
+        if self._depth == 1 and self._expect_key:
+            self._key = value
+        elif self._in_tasks and self._depth == 2:
+            self._emit_task(value, events)
+
+    def _emit_task(self, value, events):
+        if isinstance(value, dict):
+            value = value.get("task", "")
+        if not isinstance(value, str):
+            value = str(value)
+        self.tasks.append(value)
+        events.append((TASK, value))
+
+    def _finish(self, events):
+        self.done = True
+        try:
+            self.result = json.loads("".join(self._raw))
+        except ValueError:
+            # Closed but not valid JSON (let the caller's retry/repair handle it)
+            self.result = None
+        events.append((DONE, self.result))
+
+    # Everything received so far, for callers that fall back to a full parse
+    def text(self):
+        return "".join(self._raw)
+
+
+_END = object()
@@ -0,0 +1,251 @@
+# Local stand-in for both LLM APIs so failover/hedging can be exercised offline
+# (and the mock server behind bench/).
+#
+#   python -m ophub.stub_server --port 8765 --latency 2 --token-rate 40 --malformed-rate 0.1
+#
+# OpenAI-compatible: AI_BASE_URL=http://127.0.0.1:8765/v1  (POST /v1/chat/completions, stream or not)
+# Gemini-shaped:     base_url http://127.0.0.1:8765/        (POST /v1beta/models/<model>:generateContent
+#                                                             and :streamGenerateContent?alt=sse)
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = {
+    "reasoning": (
+        "Stub answer. The notes mention a SAN and Client Acceptance; opening a job also needs "
+        "a signed EL and an EA, and the EA can be done now that CA is in place."
+    ),
+    "tasks": ["Obtain signed EL", "Complete EA", "Open job"],
+}
+
+CHARS_PER_TOKEN = 4
+
+# Ways real models break the JSON answer. Most are repairable locally, the last two are not.
+MALFORMED = [
+    lambda text: f"```json\n{text}\n```",  # markdown fence
+    lambda text: text.replace('"]', '",]'),  # trailing comma
+    lambda text: text.replace('"', "\u201c", 2),  # smart quotes
+    lambda text: f"Sure! Here is the analysis:\n{text}\nLet me know if you need more.",  # chatter around it
+    lambda text: text[:len(text) // 3],  # cut off before the tasks
+    lambda text: "I could not produce JSON for this request.",
+]
+
+
+class StubConfig:
+    # Behaviour knobs, shared by every request handler thread
+
+    def __init__(self, latency=0.0, jitter=0.0, chunk_size=16, status=None, fail_rate=0.0, answer=None,
+                 token_rate=0.0, malformed_rate=0.0):
+        self.latency = latency  # seconds before the first byte
+        self.jitter = jitter  # extra random latency, 0..jitter seconds
+        self.chunk_size = chunk_size  # characters per streamed chunk
+        self.status = status  # force every request to fail with this HTTP status
+        self.fail_rate = fail_rate  # fraction of requests answered with a 503
+        self.answer = answer or DEFAULT_ANSWER
+        self.token_rate = token_rate  # generated tokens per second (~4 chars each), 0 = instant
+        self.malformed_rate = malformed_rate  # fraction of answers with broken JSON
+        self.requests = 0
+        self.malformed = 0
+        self.lock = threading.Lock()
+
+    def answer_text(self):
+        text = json.dumps(self.answer)
+        if self.malformed_rate and random.random() < self.malformed_rate:
+            with self.lock:
+                self.malformed += 1
+            return random.choice(MALFORMED)(text)
+        return text
+
+    # How long generating this much text takes at token_rate
+    def generation_time(self, text):
+        if not self.token_rate:
+            return 0.0
+        return len(text) / CHARS_PER_TOKEN / self.token_rate
+
+
+def _tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _openai_usage(prompt_tokens, text):
+    completion_tokens = _tokens(text)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _openai_body(model, text, prompt_tokens=0):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": _openai_usage(prompt_tokens, text),
+    }
+
+
+def _openai_chunk(model, text, finish=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": text} if text else {}, "finish_reason": finish}],
+    }
+
+
+def _gemini_body(text, finish=True, prompt_tokens=0, answer=""):
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    body = {"candidates": [candidate]}
+    if finish:
+        candidate["finishReason"] = "STOP"
+        output_tokens = _tokens(answer or text)
+        body["usageMetadata"] = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                                 "totalTokenCount": prompt_tokens + output_tokens}
+    return body
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = None  # set by make_server()
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # small SSE writes go out right away
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _sse(self, data):
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.flush()
+
+    def _end_sse(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _pieces(self, text):
+        size = max(1, self.config.chunk_size)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    # Latency + injected failures. Returns False when the request was answered with an error.
+    def _before_answer(self):
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        time.sleep(config.latency + random.uniform(0, config.jitter))
+        status = config.status
+        if status is None and config.fail_rate and random.random() < config.fail_rate:
+            status = 503
+        if status is not None:
+            self._send_json(status, {"error": {"code": status, "message": "stub failure", "status": "UNAVAILABLE"}})
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+
+        if path.endswith("/chat/completions"):
+            return self._openai(request)
+        if ":generateContent" in path or ":streamGenerateContent" in path:
+            return self._gemini(path, request)
+        self._send_json(404, {"error": {"code": 404, "message": f"unknown path {path}"}})
+
+    def _openai(self, request):
+        if not self._before_answer():
+            return
+        model = request.get("model", "stub")
+        text = self.config.answer_text()
+        prompt_tokens = _tokens(json.dumps(request.get("messages", "")))
+        if not request.get("stream"):
+            time.sleep(self.config.generation_time(text))
+            return self._send_json(200, _openai_body(model, text, prompt_tokens))
+        self._start_sse()
+        for piece in self._pieces(text):
+            time.sleep(self.config.generation_time(piece))
+            self._sse(json.dumps(_openai_chunk(model, piece)))
+        self._sse(json.dumps(_openai_chunk(model, None, finish="stop")))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._sse(json.dumps(dict(_openai_chunk(model, None), choices=[], usage=_openai_usage(prompt_tokens, text))))
+        self._sse("[DONE]")
+        self._end_sse()
+
+    def _gemini(self, path, request):
+        if not self._before_answer():
+            return
+        text = self.config.answer_text()
+        prompt_tokens = _tokens(json.dumps(request.get("contents", "")) + json.dumps(request.get("systemInstruction", "")))
+        if ":streamGenerateContent" not in path:
+            time.sleep(self.config.generation_time(text))
+            return self._send_json(200, _gemini_body(text, prompt_tokens=prompt_tokens))
+        self._start_sse()
+        pieces = self._pieces(text)
+        for index, piece in enumerate(pieces):
+            time.sleep(self.config.generation_time(piece))
+            self._sse(json.dumps(_gemini_body(piece, index == len(pieces) - 1, prompt_tokens, text)))
+        self._end_sse()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # Clients hanging up mid-stream (early stop, hedging) is expected, not an error
+    def handle_error(self, request, client_address):
+        pass
+
+
+def make_server(port=8765, host="127.0.0.1", config=None):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    return StubServer((host, port), handler)
+
+
+# Run in a background thread (handy from a Python shell or a benchmark script)
+def start_background(port=0, config=None):
+    server = make_server(port, config=config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline stub for the OpenAI and Gemini APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency (seconds)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per streamed chunk")
+    parser.add_argument("--status", type=int, default=None, help="always fail with this HTTP status")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that get a 503")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="generated tokens per second (0 = instant)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of answers with broken JSON")
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, chunk_size=args.chunk_size,
+                        status=args.status, fail_rate=args.fail_rate, token_rate=args.token_rate,
+                        malformed_rate=args.malformed_rate)
+    server = make_server(args.port, args.host, config)
+    print(f"Stub LLM server on http://{args.host}:{args.port} (OpenAI: /v1, Gemini: /v1beta)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()